@@ -11,279 +11,511 @@
 # Description: This script will print a list of movies that are below the cutoff score for a given
 #              cutoff custom format score.  It will also optionally tag the movies that are below the cutoff
 #              score with a tag of your choosing.  This script is useful for finding movies that are below
-#              the cutoff score that you may want to upgrade to a better quality.
+#              the cutoff score that you may want to upgrade to a better quality.  Series are scored by
+#              their episode files and summarised per season and series.  The distribution of the scores is
+#              saved so you can see how many items are below any other cutoff score with --below.
 # Usage: python3 cutoff.py
-# Requirements: requests, tqdm
-# Version: 2.0.0
+# Requirements: Python 3.8+, requests
+# Version: 3.4.0
 # License: MIT License
 # ===================================================================================================
 
-import requests
 import os
-from tqdm import tqdm
+import time
+import argparse
+from modules import scoring
+from modules.config import Config
+from modules.logger import setup_logger
+from modules.arrpy import StARR
+from modules.report import load_state, save_state
 
+config = Config(script_name="cutoff")
+logger = setup_logger(config.log_level, "cutoff")
 
-radarr_url = 'http://localhost:7878'
-radarr_api = 'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'
+script_dir = os.path.dirname(os.path.abspath(__file__))
+logs_dir = os.path.join(script_dir, 'logs')
 
-quality_profile = 'quality_profile_name'
-cutoff_score = 1850
-ignore_tags = ['tag1', 'tag2']
-tagging = 'Yes'
-requesting = 'Yes'
-tracker_indexer = 'tracker/indexer_name'
-release_group = 'release_group_name'
 
-debug = False
-dry_run = True
+def get_format_scores(app, quality_profile):
+    """
+    Get the score of each custom format in a quality profile.
+    Parameters:
+        app (StARR): The Radarr instance.
+        quality_profile (str): The name of the quality profile.
+    Returns:
+        dict: format name -> score, or None if the quality profile doesn't exist.
+    """
+    for profile in app.get_quality_profiles() or []:
+        if profile['name'] == quality_profile:
+            return {format['name']: format['score'] for format in profile['formatItems']}
+    return None
 
-RED = '\033[31m'
-RESET = '\033[0m'
 
-def getMovies():
+def get_memberships(app, instance_name, movies):
     """
-    Get list of movies from Radarr
+    Get the custom formats of the file of every movie that has one.
+    The custom formats of each movie file are cached by file id, only new or replaced files are requested.
+    Parameters:
+        app (StARR): The Radarr instance.
+        instance_name (str): The name of the Radarr instance, used for the cache name.
+        movies (list): The movies from get_media().
     Returns:
-        list: List of movies
+        dict: movie id -> list of custom format names, movies whose file couldn't be fetched are left out
     """
-    movies = requests.get(radarr_url + "/api/v3/movie",
-                          headers={"X-Api-Key": radarr_api}).json()
-    return movies
+    file_ids = {movie['id']: str(movie['movieFile']['id']) for movie in movies if movie['hasFile'] and movie.get('movieFile')}
+    cache_name = f"cutoff_formats_{instance_name}"
+    version = scoring.formats_version(app.get_custom_formats())
+    cache = scoring.load_cache(cache_name, version) if config.use_cache else {}
+    missing = [movie_id for movie_id, file_id in file_ids.items() if file_id not in cache]
+    logger.debug(f"Requesting the files of {len(missing)} movies, {len(file_ids) - len(missing)} loaded from cache")
+    movie_files = app.get_movie_files(missing, config.workers)
+    if len(movie_files) < len(missing):
+        # Radarr may not have honoured every movieId of a request, those movies are left out rather than scored as empty
+        logger.warning(f"Requested the files of {len(missing)} movies but only {len(movie_files)} were returned, the others are not scored")
+    for movie_file in movie_files:
+        cache[str(movie_file['id'])] = [custom_format['name'] for custom_format in movie_file['customFormats']]
+    files = {file_id: cache[file_id] for file_id in file_ids.values() if file_id in cache}
+    if config.use_cache:
+        scoring.save_cache(cache_name, version, files)
+    return {movie_id: files[file_id] for movie_id, file_id in file_ids.items() if file_id in files}
 
-def getMovieFile(movie_id):
+
+def below_cutoff_movies(app, movie_ids, format_scores, cutoff_score):
     """
-    Get movie file from Radarr
+    Score movies again to find the ones that are still below the cutoff score.
     Parameters:
-        movie_id (int): ID of movie
+        app (StARR): The Radarr instance.
+        movie_ids (list): The IDs of the movies.
+        format_scores (dict): format name -> score of the quality profile.
+        cutoff_score (int): The cutoff score.
     Returns:
-        dict: Movie file
+        set: The IDs of the movies with a file scoring at or below the cutoff score, and of the movies whose file wasn't returned.
     """
-    moviefile = requests.get(
-        radarr_url + f"/api/v3/moviefile?movieId={movie_id}", headers={"X-Api-Key": radarr_api}).json()
-    return moviefile
+    memberships = {movie_file['movieId']: [custom_format['name'] for custom_format in movie_file['customFormats']] for movie_file in app.get_movie_files(movie_ids, config.workers)}
+    unscored = set(movie_ids) - set(memberships)
+    if unscored:
+        logger.warning(f"Requested the files of {len(movie_ids)} movies but only {len(memberships)} were returned, the others keep their tag")
+    scores = scoring.ScoringEngine(memberships).score([format_scores])
+    return {movie_id for movie_id, movie_scores in scores.items() if movie_scores[0] <= cutoff_score} | unscored
+
 
-def getQualityProfiles():
+def what_if_lines(distribution, thresholds, noun):
     """
-    Get list of quality profiles from Radarr
+    Get the number of items at or below each threshold for each profile.
+    Parameters:
+        distribution (ScoreDistribution): The distribution of the scores.
+        thresholds (list): The thresholds.
+        noun (str): What the items are, e.g. movies.
     Returns:
-        list: List of quality profiles
+        list: The lines to print.
     """
-    quality_profiles = requests.get(
-        radarr_url + "/api/v3/qualityprofile", headers={"X-Api-Key": radarr_api}).json()
-    return quality_profiles
+    lines = [f'{f" {noun.capitalize()} at or below each cutoff score ":*^40}']
+    for index, profile in enumerate(distribution.profiles):
+        counts = [distribution.count_below(index, threshold) for threshold in thresholds]
+        lines.append(f"{profile}: " + ', '.join(f"{threshold}: {count}" for threshold, count in zip(thresholds, counts)))
+    lines.append('*' * 40)
+    return lines
 
-def getTags():
+
+def histogram_lines(distribution, cutoff_score, noun):
     """
-    Get list of tags from Radarr
+    Get a histogram of the scores of the first profile, with the share of items at or below each score.
+    Parameters:
+        distribution (ScoreDistribution): The distribution of the scores.
+        cutoff_score (int): The cutoff score, scores at or below it are marked.
+        noun (str): What the items are, e.g. movies.
     Returns:
-        list: List of tags
+        list: The lines to print.
     """
-    tags = requests.get(radarr_url + "/api/v3/tag",
-                        headers={"X-Api-Key": radarr_api}).json()
-    return tags
+    lines = [f'{f" Score distribution of {noun} ({distribution.profiles[0]}) ":*^40}']
+    scores, cumulative = distribution.cdf(0)
+    if not scores:
+        return lines + ['*' * 40]
+    histogram = distribution.histograms[0]
+    largest = max(histogram.values())
+    lines.append(f"{'Score':>7} | {'Count':>6} | {'At or below':>11} |")
+    for score, count in zip(scores, cumulative):
+        marker = '*' if score <= cutoff_score else ' '
+        bar = '#' * max(1, round(histogram[score] / largest * 30))
+        lines.append(f"{score:>6}{marker} | {histogram[score]:>6} | {count / distribution.total * 100:>10.2f}% | {bar}")
+    lines.append(f"* at or below the cutoff score of {cutoff_score}")
+    lines.append('*' * 40)
+    return lines
 
-def get_tag_id(tag_name):
+
+def sort_title(title):
+    """
+    Get the title to sort by, without leading articles.
+    """
+    return ' '.join([word for word in title.split() if word.lower() not in ['the', 'an', 'a']])
+
+
+def write_report(instance_name, settings, movies_to_print, stats, analytics):
     """
-    Get tag ID from Radarr
+    Write the statistics and the movies below the cutoff to logs/scored_movies_<instance>.txt.
     Parameters:
-        tag_name (str): Name of tag
+        instance_name (str): The name of the Radarr instance.
+        settings (dict): The settings of the instance.
+        movies_to_print (list): The movies below the cutoff, sorted.
+        stats (dict): The statistics of the run.
+        analytics (list): Lines with the score distribution and the number of movies below each threshold for each profile.
+    """
+    os.makedirs(logs_dir, exist_ok=True)
+    percentage = round(stats['cutoff_unmet'] / stats['total_movies'] * 100, 2) if stats['total_movies'] else 0
+    lines = [
+        f'{" Statistics ":*^40}',
+        f"Total movies printed: {stats['movies_printed']}",
+        f"Total movies tagged: {stats['tagged_movies']}",
+        f"Total movies untagged: {stats['untagged_movies']}",
+        f"Total movies: {stats['total_movies']}",
+        f"Total movies below cutoff score: {stats['cutoff_unmet']}",
+        f"Total movies above cutoff score: {stats['cutoff_met']}",
+        f"Percentage of movies below cutoff score: {percentage}%",
+        '*' * 40,
+    ] + analytics
+    for line in lines:
+        logger.info(line)
+    with open(os.path.join(logs_dir, f'scored_movies_{instance_name}.txt'), 'w') as f:
+        for line in lines:
+            print(line, file=f)
+        print('', file=f)
+        if settings['requesting']:
+            print(f"Below is a list of movies below the cutoff score of {settings['cutoff_score']}\nThese are formatted to help make requests on {settings['tracker_indexer']}", file=f)
+        for movie, movie_score in movies_to_print:
+            print('*' * 40, file=f)
+            print(f"{movie['title']} has a total score of {movie_score}\n", file=f)
+            print(f"Movie IMDb ID: {movie.get('imdbId')}", file=f)
+            print(f"Movie TMDB ID: {movie.get('tmdbId')}", file=f)
+            print(f"{movie['title']} ({movie['year']})", file=f)
+            print(f"{movie['title']} ({movie['year']}) - {settings['release_group']}", file=f)
+            print(f"Requesting {movie['title']} ({movie['year']}) from {settings['release_group']}.\nThank you.", file=f)
+
+
+def get_profiles(app, instance_name, settings):
+    """
+    Get the profiles and thresholds to score against.
+    Parameters:
+        app (StARR): The ARR instance.
+        instance_name (str): The name of the ARR instance.
+        settings (dict): The settings of the instance.
     Returns:
-        int: Tag ID
+        list: The profile names, the cutoff scores and the format scores of each profile, or None if a profile doesn't exist.
     """
-    response = requests.get(radarr_url + "/api/v3/tag",
-                            headers={"X-Api-Key": radarr_api})
-    response.raise_for_status()
-    for tag in response.json():
-        if tag["label"] == tag_name:
-            return tag["id"]
-    return None
+    profiles = settings['quality_profile'] if isinstance(settings['quality_profile'], list) else [settings['quality_profile']]
+    thresholds = settings['cutoff_score'] if isinstance(settings['cutoff_score'], list) else [settings['cutoff_score']]
+    profile_scores = []
+    for profile in profiles:
+        format_scores = get_format_scores(app, profile)
+        if format_scores is None:
+            logger.error(f"Quality profile {profile} not found in {instance_name}")
+            return None
+        profile_scores.append(format_scores)
+    return [profiles, thresholds, profile_scores]
+
+
+def add_score(summary, score, cutoff_score):
+    """
+    Add the score of an episode file to a running summary.
+    Parameters:
+        summary (dict): The summary, updated in place.
+        score (int): The score of the file.
+        cutoff_score (int): The cutoff score.
+    """
+    summary['files'] += 1
+    summary['total'] += score
+    summary['below'] += score <= cutoff_score
+    summary['lowest'] = score if summary['lowest'] is None else min(summary['lowest'], score)
+
+
+def new_summary():
+    return {'files': 0, 'below': 0, 'total': 0, 'lowest': None}
+
+
+def format_summary(summary):
+    """
+    Format a summary for the report.
+    """
+    return f"{summary['below']} of {summary['files']} episode files below the cutoff score, lowest score {summary['lowest']}, average score {round(summary['total'] / summary['files'])}"
 
 
-def add_tag(tag_name):
+def process_series_instance(instance_name, url, api, settings, dry_run):
     """
-    Add tag to Radarr
+    Score every episode file and summarise the scores per season and series.
+    Episode files are fetched one series at a time and only the summaries are kept, so memory use stays flat
+    however many episodes there are. A series is tagged if any of its episode files is below the cutoff.
     Parameters:
-        tag_name (str): Name of tag
+        instance_name (str): The name of the Sonarr instance.
+        url (str): The URL of the Sonarr instance.
+        api (str): The API key of the Sonarr instance.
+        settings (dict): The settings of the instance.
+        dry_run (bool): Whether or not to only log the tags that would be changed.
     """
-    response = requests.post(radarr_url + "/api/v3/tag",
-                             headers={"X-Api-Key": radarr_api}, json={"label": tag_name})
-    response.raise_for_status()
+    app = StARR(url, api, logger)
+    profile_settings = get_profiles(app, instance_name, settings)
+    if profile_settings is None:
+        return
+    profiles, thresholds, profile_scores = profile_settings
+    tag_id = None
+    tag_name = settings['tag_name']
+    if settings['tagging']:
+        tag_id = app.check_and_create_tag(tag_name, dry_run)
+        logger.debug(f"Tag ID for {tag_name} is {tag_id}")
+    all_series = [item for item in app.get_media() if item.get('statistics', {}).get('episodeFileCount')]
+    series = all_series
+    if settings['cutoff_unmet']:
+        # Only fetch the episode files of series Sonarr reports as having episodes below their cutoff
+        wanted_ids = {episode['seriesId'] for episode in app.iter_wanted_cutoff(workers=config.workers)}
+        series = [item for item in all_series if item['id'] in wanted_ids]
+    series_by_id = {item['id']: item for item in series}
+    tags = app.get_all_tags()
+    ignore_tag_ids = {tag['id'] for tag in tags if tag['label'] in (settings['ignore_tags'] or [])}
+    cutoff_score = thresholds[0]
+    logger.info(f"Scoring the episode files of {len(series)} series against {', '.join(profiles)}")
+    totals = new_summary()
+    distribution = scoring.ScoreDistribution(profiles)
+    below_ids = set()
+    to_tag = []
+    to_untag = []
+    os.makedirs(logs_dir, exist_ok=True)
+    with open(os.path.join(logs_dir, f'scored_series_{instance_name}.txt'), 'w') as f:
+        for series_id, episode_files in app.iter_episode_files(list(series_by_id), config.workers):
+            item = series_by_id[series_id]
+            memberships = {episode_file['id']: [custom_format['name'] for custom_format in episode_file.get('customFormats') or []] for episode_file in episode_files}
+            scores = scoring.ScoringEngine(memberships).score(profile_scores)
+            series_summary = new_summary()
+            seasons = {}
+            for episode_file in episode_files:
+                file_scores = scores[episode_file['id']]
+                distribution.add(file_scores)
+                for summary in [totals, series_summary, seasons.setdefault(episode_file['seasonNumber'], new_summary())]:
+                    add_score(summary, file_scores[0], cutoff_score)
+            if not series_summary['files']:
+                continue
+            below_cutoff = series_summary['below'] > 0
+            if below_cutoff:
+                below_ids.add(series_id)
+            if below_cutoff and not ignore_tag_ids.intersection(item['tags']):
+                logger.info(f"\tSeries: {item['title']} ({item['year']}) has {series_summary['below']} of {series_summary['files']} episode files below the cutoff score")
+                print('*' * 40, file=f)
+                print(f"{item['title']} ({item['year']}): {format_summary(series_summary)}", file=f)
+                for season_number, summary in sorted(seasons.items()):
+                    if summary['below']:
+                        print(f"\tSeason {season_number}: {format_summary(summary)}", file=f)
+            if settings['tagging']:
+                if below_cutoff and tag_id not in item['tags']:
+                    to_tag.append(item)
+                elif not below_cutoff and tag_id in item['tags']:
+                    to_untag.append(item)
+        untag_ids = [item['id'] for item in to_untag]
+        state_name = f"cutoff_tagged_{instance_name}"
+        series_below = len(below_ids)
+        if settings['cutoff_unmet'] and settings['tagging']:
+            # Series that reached the cutoff of their quality profile are no longer returned, the ones tagged on an
+            # earlier run are scored again and untagged once none of their episode files are below the cutoff score
+            files_ids = {item['id'] for item in all_series}
+            dropped_ids = [series_id for (series_id,) in load_state(state_name) or set() if series_id not in below_ids and series_id not in untag_ids]
+            for series_id, episode_files in app.iter_episode_files([series_id for series_id in dropped_ids if series_id in files_ids], config.workers):
+                memberships = {episode_file['id']: [custom_format['name'] for custom_format in episode_file.get('customFormats') or []] for episode_file in episode_files}
+                if any(scores[0] <= cutoff_score for scores in scoring.ScoringEngine(memberships).score([profile_scores[0]]).values()):
+                    below_ids.add(series_id)
+            upgraded_ids = [series_id for series_id in dropped_ids if series_id not in below_ids]
+            if upgraded_ids:
+                logger.info(f"{'Would untag' if dry_run else 'Untagging'} {len(upgraded_ids)} series that are no longer below the cutoff score")
+                untag_ids.extend(upgraded_ids)
+        if settings['tagging'] and not dry_run:
+            # Written in both modes so switching to cutoff_unmet still untags series tagged by a full run
+            save_state(state_name, set((series_id,) for series_id in below_ids))
+        if dry_run:
+            for item in to_tag:
+                logger.info(f"Would tag series: {item['title']} with: {tag_name}")
+            for item in to_untag:
+                logger.info(f"Would untag series: {item['title']} with: {tag_name}")
+        else:
+            if to_tag:
+                app.add_tag([item['id'] for item in to_tag], tag_id)
+            if untag_ids:
+                app.remove_tag(tag_id, untag_ids, tag_name, f"{len(untag_ids)}")
+        lines = [
+            f'{" Statistics ":*^40}',
+            f"Total series: {len(series)}",
+            f"Total series tagged: {len(to_tag)}",
+            f"Total series untagged: {len(untag_ids)}",
+            f"Total series with episode files below cutoff score: {series_below}",
+            f"Total episode files: {totals['files']}",
+            f"Total episode files below cutoff score: {totals['below']}",
+            f"Percentage of episode files below cutoff score: {round(totals['below'] / totals['files'] * 100, 2) if totals['files'] else 0}%",
+            '*' * 40,
+        ]
+        scoring.save_distribution(f"cutoff_distribution_{instance_name}", distribution)
+        lines += histogram_lines(distribution, cutoff_score, 'episode files')
+        if len(profiles) > 1 or len(thresholds) > 1:
+            lines += what_if_lines(distribution, thresholds, 'episode files')
+        for line in lines:
+            logger.info(line)
+            print(line, file=f)
 
 
-def tag_movie(movie_id, tag_id):
+def process_instance(instance_name, url, api, settings, dry_run):
     """
-    Tag movie in Radarr
+    Score every movie once and use the scores for both the report and the tags.
     Parameters:
-        movie_id (int): ID of movie
-        tag_id (int): ID of tag
+        instance_name (str): The name of the Radarr instance.
+        url (str): The URL of the Radarr instance.
+        api (str): The API key of the Radarr instance.
+        settings (dict): The settings of the instance.
+        dry_run (bool): Whether or not to only log the tags that would be changed.
     """
-    response = requests.put(radarr_url + f"/api/v3/movie/editor", headers={
-                            "X-Api-Key": radarr_api}, json={"movieIds": [movie_id], "tags": [tag_id], "applyTags": "add"})
-    response.raise_for_status()
+    app = StARR(url, api, logger)
+    profile_settings = get_profiles(app, instance_name, settings)
+    if profile_settings is None:
+        return
+    profiles, thresholds, profile_scores = profile_settings
+    tag_id = None
+    tag_name = settings['tag_name']
+    if settings['tagging']:
+        tag_id = app.check_and_create_tag(tag_name, dry_run)
+        logger.debug(f"Tag ID for {tag_name} is {tag_id}")
+    if settings['cutoff_unmet']:
+        # Only the movies Radarr reports as below the cutoff of their profile are transferred and scored
+        movies = list(app.iter_wanted_cutoff(workers=config.workers))
+        logger.info(f"{len(movies)} movies are below their cutoff in {instance_name}")
+    else:
+        movies = app.get_media()
+    tags = app.get_all_tags()
+    ignore_tag_ids = {tag['id'] for tag in tags if tag['label'] in (settings['ignore_tags'] or [])}
+    # The first profile and threshold decide the report and tags, the others are only summarised
+    cutoff_score = thresholds[0]
+    logger.info(f"Scoring {len(movies)} movies against {', '.join(profiles)}")
+    all_scores = scoring.ScoringEngine(get_memberships(app, instance_name, movies)).score(profile_scores)
+    scores = {movie_id: movie_scores[0] for movie_id, movie_scores in all_scores.items()}
+    distribution = scoring.ScoreDistribution(profiles)
+    for movie_scores in all_scores.values():
+        distribution.add(movie_scores)
+    scoring.save_distribution(f"cutoff_distribution_{instance_name}", distribution)
+    analytics = histogram_lines(distribution, cutoff_score, 'movies')
+    if len(profiles) > 1 or len(thresholds) > 1:
+        analytics += what_if_lines(distribution, thresholds, 'movies')
+    stats = dict.fromkeys(['movies_printed', 'tagged_movies', 'untagged_movies', 'total_movies', 'cutoff_unmet', 'cutoff_met'], 0)
+    movies_to_print = []
+    to_tag = []
+    to_untag = []
+    for movie in movies:
+        stats['total_movies'] += 1
+        movie_score = scores.get(movie['id'])
+        if movie_score is None:
+            continue
+        below_cutoff = movie_score <= cutoff_score
+        if below_cutoff:
+            stats['cutoff_unmet'] += 1
+        else:
+            stats['cutoff_met'] += 1
+        if settings['requesting'] and below_cutoff and not ignore_tag_ids.intersection(movie['tags']):
+            movies_to_print.append((movie, movie_score))
+        if settings['tagging']:
+            if below_cutoff and tag_id not in movie['tags']:
+                to_tag.append(movie)
+            elif not below_cutoff and tag_id in movie['tags']:
+                to_untag.append(movie)
+    untag_ids = [movie['id'] for movie in to_untag]
+    state_name = f"cutoff_tagged_{instance_name}"
+    below_ids = {movie['id'] for movie in movies if movie['id'] in scores and scores[movie['id']] <= cutoff_score}
+    if settings['cutoff_unmet'] and settings['tagging']:
+        # Movies that reached the cutoff of their quality profile are no longer returned, but that cutoff isn't cutoff_score,
+        # so the ones tagged on an earlier run are scored again before they are untagged
+        dropped_ids = [movie_id for (movie_id,) in load_state(state_name) or set() if movie_id not in below_ids and movie_id not in untag_ids]
+        if dropped_ids:
+            still_below = below_cutoff_movies(app, dropped_ids, profile_scores[0], cutoff_score)
+            below_ids |= still_below
+            upgraded_ids = [movie_id for movie_id in dropped_ids if movie_id not in still_below]
+            if upgraded_ids:
+                logger.info(f"{'Would untag' if dry_run else 'Untagging'} {len(upgraded_ids)} movies that are no longer below the cutoff score")
+                untag_ids.extend(upgraded_ids)
+    if settings['tagging'] and not dry_run:
+        # Written in both modes so switching to cutoff_unmet still untags movies tagged by a full run
+        save_state(state_name, set((movie_id,) for movie_id in below_ids))
+    movies_to_print.sort(key=lambda item: sort_title(item[0]['title']))
+    for movie, movie_score in movies_to_print:
+        logger.info(f"\tMovie: {movie['title']} ({movie['year']}) has a total score of {movie_score}")
+    stats['movies_printed'] = len(movies_to_print)
+    stats['tagged_movies'] = len(to_tag)
+    stats['untagged_movies'] = len(untag_ids)
+    if dry_run:
+        for movie in to_tag:
+            logger.info(f"Would tag movie: {movie['title']} with: {tag_name}")
+        for movie in to_untag:
+            logger.info(f"Would untag movie: {movie['title']} with: {tag_name}")
+    else:
+        if to_tag:
+            app.add_tag([movie['id'] for movie in to_tag], tag_id)
+        if untag_ids:
+            app.remove_tag(tag_id, untag_ids, tag_name, f"{len(untag_ids)}")
+    write_report(instance_name, settings, movies_to_print, stats, analytics)
 
 
-def untag_movie(movie_id, tag_id):
+def print_distributions(thresholds):
     """
-    Untag movie in Radarr
+    Print the number of items at or below each threshold from the distributions saved by the last run,
+    without contacting Radarr or Sonarr.
     Parameters:
-        movie_id (int): ID of movie
-        tag_id (int): ID of tag
+        thresholds (list): The thresholds.
     """
-    response = requests.put(radarr_url + f"/api/v3/movie/editor", headers={"X-Api-Key": radarr_api}, json={
-                            "movieIds": [movie_id], "tags": [tag_id], "applyTags": "remove"})
-    response.raise_for_status()
+    for script_instances, noun in [(config.radarr, 'movies'), (config.sonarr, 'episode files')]:
+        for data in script_instances or []:
+            instance_name = data['name']
+            distribution = scoring.load_distribution(f"cutoff_distribution_{instance_name}")
+            if distribution is None:
+                logger.warning(f"No score distribution saved for {instance_name}, run cutoff without --below first")
+                continue
+            logger.info('*' * 40)
+            logger.info(f'* {instance_name:^36} *')
+            logger.info('*' * 40)
+            logger.info(f"{distribution.total} {noun} scored on {time.strftime('%Y-%m-%d %H:%M', time.localtime(distribution.created))}")
+            for line in what_if_lines(distribution, thresholds, noun):
+                logger.info(line)
 
 
 def main():
     """
     Main function for the script.
     """
-    tag_id = None
-    tag_name = None
-    movies_printed = 0
-    untagged_movies = 0
-    tagged_movies = 0
-    total_movies = 0
-    cutoff_unmet = 0
-    cutoff_met = 0
-    if tagging == 'Yes':
-        if dry_run:
-            print(f"Dry Run = {dry_run}")
-        tag_name = "cutoff-unmet"
-        print(f"Retrieving tag ID for {tag_name}")
-        tag_id = get_tag_id(tag_name)
-        if not tag_id:
-            print(f"Creating new tag {tag_name}")
-            add_tag(tag_name)
-            tag_id = get_tag_id(tag_name)
-        if tag_id:
-            print(f"Tag ID for {tag_name} is {tag_id}")
-
-    movies = getMovies()
-    tags = getTags()
-    movies_without_tags = [movie for movie in movies if not any(
-        tag['label'] in ignore_tags for tag in tags if tag['id'] in movie['tags'])]
-    quality_profiles = getQualityProfiles()
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    logs_dir = os.path.join(script_dir, 'logs')
-    os.makedirs(logs_dir, exist_ok=True)
-    with open(os.path.join(logs_dir, 'scored_movies.txt'), 'w') as f:
-        below_cutoff_count = 0
-        for profile in quality_profiles:
-            if profile['name'] == quality_profile:
-                name_score_dict = {}
-                for format in profile['formatItems']:
-                    name_score_dict[format['name']] = format['score']
-                movies_to_print = []
-                if requesting == 'Yes':
-                    for movie in tqdm(movies_without_tags, desc="Processing Movies to print..."):
-                        if movie['hasFile'] == True:
-                            movie_id = movie['id']
-                            if debug:
-                                print(
-                                    f"Calculating score for movie: {movie['title']}")
-                            moviefile = getMovieFile(movie_id)
-                            movie_score = 0
-                            for format in moviefile:
-                                for custom_format in format['customFormats']:
-                                    format_name = custom_format['name']
-                                    if format_name in name_score_dict:
-                                        if debug:
-                                            print(
-                                                f"\tFormat: {format_name} Score: {name_score_dict[format_name]}")
-                                        movie_score += name_score_dict[format_name]
-                            if movie_score <= cutoff_score:
-                                movies_to_print.append(
-                                    (
-                                        movie['title'],
-                                        movie['year'],
-                                        movie_score,
-                                        movie.get('tmdbId'),
-                                        movie.get('imdbId')
-                                    )
-                                )
-                                movies_printed += 1
-                dry_run_print = []
-                if tagging == 'Yes':
-                    for movie in tqdm(movies, desc="Processing Movies to tag..."):
-                        movie_id = movie['id']
-                        if movie['hasFile'] == True:
-                            moviefile = getMovieFile(movie_id)
-                            movie_score = 0
-                            for format in moviefile:
-                                for custom_format in format['customFormats']:
-                                    format_name = custom_format['name']
-                                    if format_name in name_score_dict:
-                                        movie_score += name_score_dict[format_name]
-                            if movie_score <= cutoff_score and tag_id not in movie['tags']:
-                                if dry_run:
-                                    dry_run_print.append(
-                                        f"Would tag movie: {movie['title']} with: {tag_name}")
-                                else:
-                                    tag_movie(movie_id, tag_id)
-                                tagged_movies += 1
-                            elif movie_score > cutoff_score and tag_id in movie['tags']:
-                                if dry_run:
-                                    dry_run_print.append(
-                                        f"Would untag movie: {movie['title']} with: {tag_name}")
-                                else:
-                                    untag_movie(movie_id, tag_id)
-                                untagged_movies += 1
-                            if movie_score <= cutoff_score:
-                                cutoff_unmet += 1
-                            else:
-                                cutoff_met += 1
-                        total_movies += 1
-                if dry_run:
-                    for dry_run_line in dry_run_print:
-                        print(dry_run_line)
-                movies_to_print = sorted(movies_to_print, key=lambda x: ' '.join(
-                    [word for word in x[0].split() if word.lower() not in ['the', 'an', 'a']]))
-                print(f'{" Statsistics ":*^40}', file=f)
-                print(f"Total movies printed: {movies_printed}", file=f)
-                print(f"Total movies tagged: {tagged_movies}", file=f)
-                print(f"Total movies untagged: {untagged_movies}", file=f)
-                print(f"Total movies: {total_movies}", file=f)
-                print(
-                    f"Total movies below cutoff score: {cutoff_unmet}", file=f)
-                print(f"Total movies above cutoff score: {cutoff_met}", file=f)
-                print(
-                    f"Percentage of movies below cutoff score: {round(cutoff_unmet / total_movies * 100, 2)}%", file=f)
-                print(f'*' * 40, file=f)
-                print('', file=f)
-                if requesting == 'Yes':
-                    print(
-                        f"Below is a list of movies below the cutoff score of {cutoff_score}\nThese are formatted to help make requests on {tracker_indexer}", file=f)
-                for movie in movies_to_print:
-                    movie_title = movie[0]
-                    movie_year = movie[1]
-                    movie_score = movie[2]
-                    tmdb_id = movie[3]
-                    imdb_id = movie[4]
-                    print(
-                        f"\tMovie: {movie_title} ({movie_year}) has a total score of " + RED + f"{movie_score}" + RESET)
-                    print(f'*' * 40, file=f)
-                    if requesting == 'Yes':
-                        print(
-                            f"{movie_title} has a total score of {movie_score}\n", file=f)
-                        print(f"Movie IMDb ID: {imdb_id}", file=f)
-                        print(f"Movie TMDB ID: {tmdb_id}", file=f)
-                        print(f"{movie_title} ({movie_year})", file=f)
-                        print(
-                            f"{movie_title} ({movie_year}) - {release_group}", file=f)
-                        print(
-                            f"Requesting {movie_title} ({movie_year}) from {release_group}.\nThank you.", file=f)
-        print('')
-        print(f'{" Statsistics ":*^40}')
-        print(f'Total movies: {total_movies}')
-        print(f"Total movies printed: {movies_printed}")
-        print(f"Total movies tagged: {tagged_movies}")
-        print(f"Total movies untagged: {untagged_movies}")
-        print(f"Total movies below cutoff score: {cutoff_unmet}")
-        print(f"Total movies above cutoff score: {cutoff_met}")
-        print(
-            f"Percentage of movies below cutoff score: {round(cutoff_unmet / total_movies * 100, 2)}%")
-        print(f'*' * 40)
+    parser = argparse.ArgumentParser(description="Score movies and series against their quality profiles and tag the ones below the cutoff score")
+    parser.add_argument('--below', type=int, nargs='+', default=None, metavar='SCORE', help="Print how many items were at or below each score on the last run and exit")
+    args = parser.parse_args()
+    if args.below:
+        print_distributions(args.below)
+        return
+    if config.dry_run:
+        logger.info('*' * 40)
+        logger.info(f'* {"Dry_run Activated":^36} *')
+        logger.info('*' * 40)
+        logger.info(f'* {" NO CHANGES WILL BE MADE ":^36} *')
+        logger.info('*' * 40)
+        logger.info('')
+    instance_data = [
+        (config.radarr_data, config.radarr, process_instance),
+        (config.sonarr_data, config.sonarr, process_series_instance),
+    ]
+    for instances, script_instances, process in instance_data:
+        for instance in instances:
+            instance_name = instance['name']
+            data = next((data for data in script_instances or [] if data['name'] == instance_name), None)
+            if not data:
+                continue
+            settings = {
+                'quality_profile': data.get('quality_profile'),
+                'cutoff_score': data.get('cutoff_score', 0),
+                'ignore_tags': data.get('ignore_tags', []),
+                'tagging': data.get('tagging', False),
+                'tag_name': data.get('tag_name', 'cutoff-unmet'),
+                'requesting': data.get('requesting', False),
+                'tracker_indexer': data.get('tracker_indexer', ''),
+                'release_group': data.get('release_group', ''),
+                'cutoff_unmet': data.get('cutoff_unmet', False),
+            }
+            logger.info('*' * 40)
+            logger.info(f'* {instance_name:^36} *')
+            logger.info('*' * 40)
+            process(instance_name, instance['url'], instance['api'], settings, config.dry_run)
 
 
 if __name__ == '__main__':
@@ -2,6 +2,10 @@ import sys
 import requests
 import json
 import logging
+from collections import deque
+from itertools import islice
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 
 
 logging.getLogger("qbittorrentapi").setLevel(logging.WARNING)
@@ -162,6 +166,24 @@ class StARR:
                 exit()
                 return r['id']
 
+    def get_movie_files(self, movie_ids, workers=8, chunk_size=250):
+        """
+        Get the files for many movies at once, movies are requested in chunks and the chunks are fetched concurrently.
+        Parameters:
+            movie_ids (list): The IDs of the movies.
+            workers (int): The number of requests to make at the same time.
+            chunk_size (int): The number of movies per request.
+        Returns:
+            list: A list of movie file objects, each with the movieId it belongs to.
+        """
+        chunks = [movie_ids[i:i + chunk_size] for i in range(0, len(movie_ids), chunk_size)]
+        endpoints = [f"{self.url}/api/v3/moviefile?" + "&".join(f"movieId={movie_id}" for movie_id in chunk) for chunk in chunks]
+        movie_files = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for response in executor.map(self.make_get_request, endpoints):
+                movie_files.extend(response or [])
+        return movie_files
+
     def get_media(self):
         """
         Get all media from the ARR instance.
@@ -176,6 +198,28 @@ class StARR:
         endpoint = f"{self.url}/api/v3/{media}"
         return self.make_get_request(endpoint)
 
+    def iter_wanted_cutoff(self, page_size=250, workers=4):
+        """
+        Iterate over the monitored media that has a file below the cutoff of its quality profile, as worked out by the ARR instance.
+        The first page is fetched to get the total, the remaining pages are fetched concurrently.
+        Radarr returns movies, Sonarr returns episodes with their series included.
+        Parameters:
+            page_size (int): The number of records per page.
+            workers (int): The number of pages to fetch at the same time.
+        Yields:
+            dict: A movie or episode object.
+        """
+        endpoint = f"{self.url}/api/v3/wanted/cutoff?pageSize={page_size}&monitored=true"
+        if self.instance_type == 'Sonarr':
+            endpoint += "&includeSeries=true"
+        response = self.make_get_request(f"{endpoint}&page=1")
+        yield from response.get('records', [])
+        pages = -(-response.get('totalRecords', 0) // page_size)
+        if pages > 1:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                for response in executor.map(self.make_get_request, [f"{endpoint}&page={page}" for page in range(2, pages + 1)]):
+                    yield from response.get('records', [])
+
     def get_all_tags(self):
         """
         Get all tags from the ARR instance.
@@ -447,15 +491,18 @@ class StARR:
             self.logger.error(f"Failed to search for season {season_number} of series with ID {media_id}")
             return False
     
-    def get_season_data(self, media_id):
+    def get_season_data(self, media_id, include_episode_file=False):
         """
         Get data for a season.
         Parameters:
             media_id (int): The ID of the series to get data for
+            include_episode_file (bool): Whether to include the episode file of each episode, including its path
         Returns:
             list: A list of dictionaries representing the episodes for the season
         """
         endpoint = f"{self.url}/api/v3/episode?seriesId={media_id}"
+        if include_episode_file:
+            endpoint += "&includeEpisodeFile=true"
         response = self.make_get_request(endpoint, headers=self.headers)
         if response:
             return response
@@ -463,6 +510,68 @@ class StARR:
             self.logger.error(f"Failed to get data for series with ID {media_id}")
             return False
 
+    def get_episode_files(self, media_id):
+        """
+        Get the episode files for a series.
+        Parameters:
+            media_id (int): The ID of the series to get episode files for
+        Returns:
+            list: A list of dictionaries representing the episode files, including their path
+        """
+        endpoint = f"{self.url}/api/v3/episodefile?seriesId={media_id}"
+        response = self.make_get_request(endpoint, headers=self.headers)
+        if response:
+            return response
+        else:
+            self.logger.error(f"Failed to get episode files for series with ID {media_id}")
+            return False
+
+    def iter_episode_files(self, series_ids, workers=8):
+        """
+        Iterate over the episode files of many series, fetching several series at the same time.
+        Only a few requests are in flight at once so memory use doesn't grow with the size of the library.
+        Parameters:
+            series_ids (list): The IDs of the series, series without files should be left out.
+            workers (int): The number of requests to make at the same time.
+        Yields:
+            tuple: The series ID and a list of its episode files, in the order of series_ids.
+        """
+        yield from self.iter_series(self.get_episode_files, series_ids, workers)
+
+    def iter_season_data(self, series_ids, workers=8, include_episode_file=False):
+        """
+        Iterate over the episodes of many series, fetching several series at the same time.
+        Parameters:
+            series_ids (list): The IDs of the series.
+            workers (int): The number of requests to make at the same time.
+            include_episode_file (bool): Whether to include the episode file of each episode, including its path
+        Yields:
+            tuple: The series ID and a list of its episodes, in the order of series_ids.
+        """
+        yield from self.iter_series(lambda series_id: self.get_season_data(series_id, include_episode_file), series_ids, workers)
+
+    def iter_series(self, fetch, series_ids, workers):
+        """
+        Call fetch for many series, keeping only a few requests in flight at once.
+        Parameters:
+            fetch (callable): Takes a series ID and returns a list.
+            series_ids (list): The IDs of the series.
+            workers (int): The number of requests to make at the same time.
+        Yields:
+            tuple: The series ID and the result of fetch, in the order of series_ids.
+        """
+        workers = max(1, workers)
+        series_ids = iter(series_ids)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for series_id in islice(series_ids, workers * 2):
+                pending.append((series_id, executor.submit(fetch, series_id)))
+            while pending:
+                series_id, future = pending.popleft()
+                for next_id in islice(series_ids, 1):
+                    pending.append((next_id, executor.submit(fetch, next_id)))
+                yield series_id, future.result() or []
+
     def delete_episode_files(self, media_id):
         """
         Delete all episode files for a series.
@@ -527,6 +636,45 @@ class StARR:
             self.logger.error(f"Failed to get queue")
             return False
     
+    def get_queue_status(self):
+        """
+        Get the totals of the queue without fetching the queue itself.
+        Returns:
+            dict: The queue status, totalCount is the number of items in the queue.
+        """
+        endpoint = f"{self.url}/api/v3/queue/status"
+        return self.make_get_request(endpoint, headers=self.headers)
+
+    def get_history_since(self, date, event_type):
+        """
+        Get the history events of one type since a date.
+        Parameters:
+            date (str): The date in ISO 8601 format, e.g. 2023-01-01T00:00:00Z.
+            event_type (str): The type of event, e.g. grabbed or downloadFolderImported.
+        Returns:
+            list: A list of history records.
+        """
+        endpoint = f"{self.url}/api/v3/history/since?date={quote(date)}&eventType={event_type}"
+        return self.make_get_request(endpoint, headers=self.headers) or []
+
+    def get_quality_profiles(self):
+        """
+        Get the quality profiles, including their custom format scores.
+        Returns:
+            list: A list of quality profile objects.
+        """
+        endpoint = f"{self.url}/api/v3/qualityprofile"
+        return self.make_get_request(endpoint, headers=self.headers)
+
+    def get_custom_formats(self):
+        """
+        Get the custom formats, including their specifications.
+        Returns:
+            list: A list of custom format objects.
+        """
+        endpoint = f"{self.url}/api/v3/customformat"
+        return self.make_get_request(endpoint, headers=self.headers)
+
     def get_quality_profile_names(self):
         """
         Get the names of all quality profiles.
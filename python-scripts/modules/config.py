@@ -34,6 +34,8 @@ class Config:
         self.radarr = self.script_data.get('radarr', False)  # Use False as default value for radarr if not provided')
         self.sonarr = self.script_data.get('sonarr', False)  # Use False as default value for sonarr if not provided')
         self.qbit = self.script_data.get('qbittorrent', False)  # Use False as default value for qbit if not provided')
+        self.workers = self.script_data.get('workers', 8)  # Use 8 as default value for workers if not provided
+        self.instance_workers = self.script_data.get('instance_workers', 4)  # Use 4 as default value for instance_workers if not provided
 
         # Plex variables
         self.library_names = self.script_data.get('library_names', [])  # Use empty list as default value for library_names if not provided
@@ -49,15 +51,25 @@ class Config:
         self.collection_threshold = self.script_data.get('collection_threshold', 0)  # Use 0 as default value for collection_threshold if not provided
         self.action_type = self.script_data.get('action_type', 'move')  # Use 'move' as default value for action_type if not provided
         self.print_only_renames = self.script_data.get('print_only_renames', False)  # Use False as default value for print_only_renames if not provided
+        self.optimize_posters = self.script_data.get('optimize_posters', {})  # Use empty dict as default value for optimize_posters if not provided
+        self.duplicate_posters = self.script_data.get('duplicate_posters', {})  # Use empty dict as default value for duplicate_posters if not provided
 
         # unmatched-assets variables
         self.assets_path = self.script_data.get('assets_path', '') # Use empty string as default value for assets_path if not provided
         self.media_paths = self.script_data.get('media_paths', []) # Use empty list as default value for media_paths if not provided
+        self.use_cache = self.script_data.get('use_cache', True) # Use True as default value for use_cache if not provided
+        self.report_format = self.script_data.get('report_format', 'jsonl') # Use 'jsonl' as default value for report_format if not provided
+        self.inventory = self.script_data.get('inventory', 'filesystem') # Use 'filesystem' as default value for inventory if not provided
+        self.suggestions = self.script_data.get('suggestions', 3) # Use 3 as default value for suggestions if not provided
+        self.suggestion_threshold = self.script_data.get('suggestion_threshold', 80) # Use 80 as default value for suggestion_threshold if not provided
 
         # nohl
         self.movies = self.script_data.get('movies', False)  # Use False as default value for movies if not provided
         self.series = self.script_data.get('series', False)  # Use False as default value for tv_shows if not provided
         self.maximum_searches = self.script_data.get('maximum_searches', 0)  # Use 0 as default value for maximum_searches if not provided
+        self.extensions = self.script_data.get('extensions', ['.mkv', '.mp4'])  # Use ['.mkv', '.mp4'] as default value for extensions if not provided
+        self.relink = self.script_data.get('relink', {})  # Use empty dict as default value for relink if not provided
+        self.queue_priority = self.script_data.get('queue_priority', 'oldest')  # Use 'oldest' as default value for queue_priority if not provided
 
         #labelarr
         self.labels = self.script_data.get('labels', '[]')
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import pathlib
+
+base_dir = pathlib.Path(__file__).parent.parent
+tmp_dir = f'{base_dir}/tmp'
+
+
+class DirCache:
+    def __init__(self, name, logger, enabled=True, version=None, max_age=None):
+        """
+        Initialize a DirCache object, a persistent cache of what was found in a directory keyed by the directory's mtime.
+        A directory's mtime changes whenever an entry is added, removed or renamed in it, so a cached listing
+        is reused until that happens.
+        Parameters:
+            name (str): The name of the cache, used for the file name in the tmp folder.
+            logger (logging.Logger): a logger object for logging debug messages.
+            enabled (bool): Whether or not to use the cache, when disabled every directory is scanned.
+            version: Anything JSON serializable that the cached results depend on, the cache is dropped when it changes.
+            max_age (int): Drop the cache and rescan everything once it is older than this many seconds.
+        """
+        self.logger = logger
+        self.enabled = enabled
+        self.version = version
+        self.max_age = max_age
+        self.cache_path = f'{tmp_dir}/{name}.json'
+        self.created = time.time()
+        self.entries = {}
+        self.seen = {}
+        self.partial = set()
+        self.hits = 0
+        self.misses = 0
+        if enabled:
+            self.load()
+
+    def load(self):
+        """
+        Load the cache from disk, a missing or corrupt cache is treated as empty.
+        """
+        try:
+            with open(self.cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        if data.get('version') != self.version:
+            data = {}
+        elif self.max_age and time.time() - data.get('created', 0) > self.max_age:
+            self.logger.info("Directory cache has expired, rescanning everything")
+            data = {}
+        self.created = data.get('created', self.created)
+        self.entries = data.get('entries', {})
+        self.partial = set(data.get('partial', []))
+        self.logger.debug(f"Loaded {len(self.entries)} cached directories from {self.cache_path}")
+
+    def save(self, keep_unseen=False):
+        """
+        Save the directories seen this run, directories that no longer exist are dropped.
+        A walk that is spread over several runs only prunes once it is complete, against every directory seen by any of its runs.
+        Parameters:
+            keep_unseen (bool): Keep the directories that weren't seen, for runs that only scanned part of the tree.
+        """
+        if not self.enabled:
+            return
+        entries = dict(self.entries, **self.seen)
+        seen = self.partial | set(self.seen)
+        if keep_unseen:
+            partial = sorted(seen)
+        else:
+            entries = {path: entry for path, entry in entries.items() if path in seen}
+            partial = []
+        os.makedirs(tmp_dir, exist_ok=True)
+        with open(f'{self.cache_path}.tmp', 'w') as f:
+            json.dump({'version': self.version, 'created': self.created, 'entries': entries, 'partial': partial}, f)
+        os.replace(f'{self.cache_path}.tmp', self.cache_path)
+        self.logger.debug(f"Directory cache: {self.hits} unchanged, {self.misses} rescanned")
+
+    def get_or_scan(self, path, scan):
+        """
+        Get the cached result for a directory, or scan it if it has changed since the last run.
+        Parameters:
+            path (str): The directory.
+            scan (function): Called with the path to scan the directory, must return something JSON serializable.
+        Returns:
+            The cached or scanned result.
+        Raises:
+            OSError: If the directory can't be stat'd.
+        """
+        if not self.enabled:
+            return scan(path)
+        mtime = os.stat(path).st_mtime_ns
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == mtime:
+            self.hits += 1
+            result = entry[1]
+        else:
+            self.misses += 1
+            result = scan(path)
+        self.seen[path] = [mtime, result]
+        return result
@@ -3,9 +3,52 @@ import time
 import logging
 import logging.handlers
 import pathlib
+import threading
+from contextlib import contextmanager
 
 base_dir = pathlib.Path(__file__).parent.parent
 
+
+class ThreadBuffer(logging.Filter):
+    """
+    A filter that holds back the records of threads that are buffering, see buffer_logs.
+    """
+    def __init__(self):
+        super().__init__()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        records = getattr(self.local, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
+thread_buffer = ThreadBuffer()
+
+
+@contextmanager
+def buffer_logs(logger):
+    """
+    Hold back the messages logged by the current thread and log them all at once at the end,
+    so the output of instances processed at the same time isn't interleaved.
+    Parameters:
+        logger (logging.Logger): The logger the messages are logged with.
+    """
+    if thread_buffer not in logger.filters:
+        logger.addFilter(thread_buffer)
+    thread_buffer.local.records = []
+    try:
+        yield
+    finally:
+        records = thread_buffer.local.records
+        thread_buffer.local.records = None
+        with thread_buffer.lock:
+            for record in records:
+                logger.handle(record)
+
 def setup_logger(log_level, script_name):
     """
     Setup the logger.
@@ -0,0 +1,259 @@
+import os
+import json
+import shutil
+import hashlib
+import pathlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+base_dir = pathlib.Path(__file__).parent.parent
+tmp_dir = f'{base_dir}/tmp'
+cache_dir = f'{tmp_dir}/posters'
+cache_path = f'{tmp_dir}/poster_optimizer.json'
+
+formats = {
+    'jpeg': ('JPEG', '.jpg'),
+    'jpg': ('JPEG', '.jpg'),
+    'webp': ('WEBP', '.webp'),
+    'png': ('PNG', '.png'),
+}
+
+
+def load_settings(settings):
+    """
+    Merge the optimize_posters section of the config with the defaults.
+    Parameters:
+        settings (dict): The optimize_posters section of the config.
+    Returns:
+        dict: The settings to use.
+    """
+    settings = settings or {}
+    return {
+        'enabled': settings.get('enabled', False),
+        'max_size': int(settings.get('max_size', 2000)),
+        'format': str(settings.get('format', 'jpeg')).lower(),
+        'quality': int(settings.get('quality', 90)),
+        'workers': settings.get('workers') or os.cpu_count() or 1,
+    }
+
+
+def file_digest(path):
+    """
+    Get the sha1 digest of a file.
+    Parameters:
+        path (str): The path of the file.
+    Returns:
+        str: The hex digest of the file contents.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_digest(path, cache):
+    """
+    Get the sha1 digest of a file, reusing the digest of an earlier run while its size and modification time are unchanged.
+    Parameters:
+        path (str): The path of the file.
+        cache (dict): The optimizer cache from load_cache.
+    Returns:
+        str: The hex digest of the file contents.
+    """
+    stat = os.stat(path)
+    fingerprint = [stat.st_size, stat.st_mtime_ns]
+    cached = cache['digests'].get(path)
+    if cached and cached[:2] == fingerprint:
+        return cached[2]
+    digest = file_digest(path)
+    cache['digests'][path] = fingerprint + [digest]
+    return digest
+
+
+def optimize_poster(source_path, output_path, max_size, image_format, quality):
+    """
+    Resize and re-encode a single poster. Runs inside the process pool.
+    Parameters:
+        source_path (str): The poster to optimize.
+        output_path (str): Where to write the optimized poster.
+        max_size (int): The maximum width or height in pixels.
+        image_format (str): The format to save in, 'keep' keeps the source format.
+        quality (int): The JPEG/WebP quality.
+    Returns:
+        bool: True if the optimized poster was written, False if the source is already smaller.
+    """
+    with Image.open(source_path) as image:
+        pil_format = image.format if image_format == 'keep' else formats[image_format][0]
+        if max(image.size) > max_size:
+            image.thumbnail((max_size, max_size), Image.LANCZOS)
+        if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        options = {'optimize': True}
+        if pil_format in ('JPEG', 'WEBP'):
+            options['quality'] = quality
+        image.save(output_path, pil_format, **options)
+    if image_format == 'keep' and os.path.getsize(output_path) >= os.path.getsize(source_path):
+        os.remove(output_path)
+        return False
+    return True
+
+
+def load_cache(settings):
+    """
+    Load the optimizer cache, the cache is dropped if the settings have changed.
+    Parameters:
+        settings (dict): The optimizer settings.
+    Returns:
+        dict: The cache.
+    """
+    key = {k: settings[k] for k in ('max_size', 'format', 'quality')}
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+        if cache.get('settings') == key:
+            cache['outputs'] = set(cache.get('outputs', []))
+            cache.setdefault('optimized', {})
+            cache.setdefault('digests', {})
+            return cache
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return {'settings': key, 'sources': {}, 'outputs': set(), 'optimized': {}, 'digests': {}}
+
+
+def save_cache(cache):
+    """
+    Save the optimizer cache.
+    Parameters:
+        cache (dict): The cache to save.
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    digests = {path: value for path, value in cache['digests'].items() if os.path.exists(path)}
+    data = dict(cache, outputs=sorted(cache['outputs']), digests=digests)
+    with open(f'{cache_path}.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(f'{cache_path}.tmp', cache_path)
+
+
+def find_optimized(source_path, destination_path, cache):
+    """
+    Find the optimized copy of a poster placed by an earlier run.
+    An optimized poster no longer matches its source, it mustn't be treated as a conflict and replaced,
+    or it would be placed and optimized again on every run.
+    Parameters:
+        source_path (str): The poster in the source directory.
+        destination_path (str): Where the poster would be placed.
+        cache (dict): The optimizer cache from load_cache.
+    Returns:
+        str: The path of the optimized copy, or None if the destination doesn't hold one.
+    """
+    stem, extension = os.path.splitext(destination_path)
+    extensions = {extension} | {cached for cached in cache['sources'].values() if cached}
+    candidates = [stem + extension for extension in extensions if os.path.isfile(stem + extension)]
+    candidates = [path for path in candidates if not os.path.samefile(path, source_path)]
+    if not candidates:
+        return None
+    output_digest = cache['optimized'].get(cached_digest(source_path, cache))
+    if output_digest is None:
+        return None
+    for path in candidates:
+        if cached_digest(path, cache) == output_digest:
+            return path
+    return None
+
+
+def install(path, blob_path, extension):
+    """
+    Put an optimized poster in place of the original, removing the original if the extension changed.
+    The poster is replaced rather than written to, so a hardlinked source is left untouched.
+    Parameters:
+        path (str): The original poster in the destination directory.
+        blob_path (str): The cached optimized poster.
+        extension (str): The extension of the optimized poster.
+    Returns:
+        str: The path of the optimized poster.
+    """
+    destination_path = os.path.splitext(path)[0] + extension
+    shutil.copyfile(blob_path, f'{destination_path}.tmp')
+    os.replace(f'{destination_path}.tmp', destination_path)
+    if destination_path != path:
+        os.remove(path)
+    return destination_path
+
+
+def optimize_posters(paths, settings, logger, cache=None):
+    """
+    Optimize posters after they have been placed in the destination directory.
+    Posters are hashed and only optimized once, repeated runs reuse the cached result.
+    Parameters:
+        paths (list): The posters to optimize.
+        settings (dict): The optimizer settings from load_settings.
+        logger (logging.Logger): a logger object for logging messages.
+        cache (dict): The optimizer cache, if the caller has loaded it. The caller saves it, otherwise it is loaded and saved here.
+    Returns:
+        list: Messages describing what was optimized.
+    """
+    messages = []
+    if not paths:
+        return messages
+    if Image is None:
+        logger.error("Pillow is not installed, unable to optimize posters. Please install it with 'pip install Pillow'")
+        return messages
+    image_format = settings['format']
+    if image_format != 'keep' and image_format not in formats:
+        logger.error(f"Unknown poster format: {image_format}, options are {', '.join(list(formats) + ['keep'])}")
+        return messages
+    own_cache = cache is None
+    if own_cache:
+        cache = load_cache(settings)
+    os.makedirs(cache_dir, exist_ok=True)
+    paths = [path for path in paths if os.path.isfile(path)]
+    with ThreadPoolExecutor(max_workers=settings['workers']) as executor:
+        digests = dict(zip(paths, executor.map(file_digest, paths)))
+    pending = {}
+    for path, digest in digests.items():
+        if digest in cache['outputs']:
+            continue
+        extension = cache['sources'].get(digest)
+        blob_path = f'{cache_dir}/{digest}{extension}'
+        if extension is not None and os.path.isfile(blob_path):
+            destination_path = install(path, blob_path, extension)
+            messages.append(f"Optimized (cached): {os.path.basename(path)} -> {os.path.basename(destination_path)}")
+        else:
+            pending.setdefault(digest, []).append(path)
+    with ProcessPoolExecutor(max_workers=settings['workers']) as executor:
+        futures = {}
+        for digest, digest_paths in pending.items():
+            source_path = digest_paths[0]
+            extension = formats[image_format][1] if image_format != 'keep' else os.path.splitext(source_path)[1]
+            blob_path = f'{cache_dir}/{digest}{extension}'
+            future = executor.submit(optimize_poster, source_path, blob_path, settings['max_size'], image_format, settings['quality'])
+            futures[future] = (digest, digest_paths, extension, blob_path)
+        for future in as_completed(futures):
+            digest, digest_paths, extension, blob_path = futures[future]
+            try:
+                optimized = future.result()
+            except Exception as e:
+                logger.error(f"Unable to optimize {digest_paths[0]}: {e}")
+                continue
+            if not optimized:
+                # Already smaller than the re-encoded version, leave it alone
+                cache['sources'][digest] = ''
+                cache['outputs'].add(digest)
+                continue
+            cache['sources'][digest] = extension
+            cache['optimized'][digest] = file_digest(blob_path)
+            cache['outputs'].add(cache['optimized'][digest])
+            for path in digest_paths:
+                before = os.path.getsize(path)
+                destination_path = install(path, blob_path, extension)
+                after = os.path.getsize(destination_path)
+                messages.append(f"Optimized: {os.path.basename(path)} -> {os.path.basename(destination_path)} ({before / 1024 / 1024:.2f} MB -> {after / 1024 / 1024:.2f} MB)")
+    if own_cache:
+        save_cache(cache)
+    return messages
@@ -0,0 +1,56 @@
+import os
+
+
+def split_path(path):
+    """
+    Split a path into its components.
+    Parameters:
+        path (str): The path to split.
+    Returns:
+        list: The non-empty components of the normalised path.
+    """
+    return [part for part in os.path.normpath(path).split(os.sep) if part]
+
+
+class PathTrie:
+    """
+    A trie of path components, used to find which configured roots a path lives under in O(depth)
+    instead of comparing it against every root.
+    Unlike str.startswith, '/data/movies' does not match '/data/movies4k/...'.
+    """
+    def __init__(self):
+        self.root = {}
+
+    def add(self, path, value):
+        """
+        Add a root.
+        Parameters:
+            path (str): The root.
+            value: The value to return for paths under the root, e.g. an instance name.
+        """
+        node = self.root
+        for part in split_path(path):
+            node = node.setdefault(part, {})
+        # Components are never empty, so '' can't clash with a child
+        values = node.setdefault('', [])
+        if value not in values:
+            values.append(value)
+
+    def find(self, path):
+        """
+        Find the values of every root the path is under.
+        Parameters:
+            path (str): The path to look up.
+        Returns:
+            list: The values, from the shallowest root to the deepest.
+        """
+        found = list(self.root.get('', []))
+        node = self.root
+        for part in split_path(path):
+            node = node.get(part)
+            if node is None:
+                break
+            for value in node.get('', []):
+                if value not in found:
+                    found.append(value)
+        return found
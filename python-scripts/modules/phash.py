@@ -0,0 +1,231 @@
+import os
+import json
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+base_dir = pathlib.Path(__file__).parent.parent
+tmp_dir = f'{base_dir}/tmp'
+cache_path = f'{tmp_dir}/phash_cache.json'
+
+
+def load_settings(settings):
+    """
+    Merge the duplicate_posters section of the config with the defaults.
+    Parameters:
+        settings (dict): The duplicate_posters section of the config.
+    Returns:
+        dict: The settings to use.
+    """
+    settings = settings or {}
+    return {
+        'enabled': settings.get('enabled', False),
+        'threshold': int(settings.get('threshold', 5)),
+        'skip_existing': settings.get('skip_existing', False),
+        'workers': settings.get('workers') or os.cpu_count() or 1,
+    }
+
+
+def dhash(path, hash_size=8):
+    """
+    Compute the difference hash of an image. Runs inside the process pool.
+    Parameters:
+        path (str): The image to hash.
+        hash_size (int): The width/height of the hash grid, 8 gives a 64 bit hash.
+    Returns:
+        int: The hash.
+    """
+    with Image.open(path) as image:
+        image.draft('L', (hash_size * 4, hash_size * 4))
+        image = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+        pixels = list(image.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a, b):
+    """
+    Get the number of bits that differ between two hashes.
+    """
+    return bin(a ^ b).count('1')
+
+
+def fingerprint(path):
+    """
+    Get the size and modification time of a file, used to tell if a cached hash is still valid.
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_cache():
+    """
+    Load the hash cache.
+    Returns:
+        dict: path -> [size, mtime_ns, hash]
+    """
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache):
+    """
+    Save the hash cache.
+    Parameters:
+        cache (dict): The cache to save.
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    with open(f'{cache_path}.tmp', 'w') as f:
+        json.dump(cache, f)
+    os.replace(f'{cache_path}.tmp', cache_path)
+
+
+def hash_files(paths, logger, workers=None):
+    """
+    Get the perceptual hash of every file, hashing in parallel only the files that are new or have changed.
+    Parameters:
+        paths (list): The images to hash.
+        logger (logging.Logger): a logger object for logging messages.
+        workers (int): The number of processes to use.
+    Returns:
+        dict: path -> hash
+    """
+    hashes = {}
+    if Image is None:
+        logger.error("Pillow is not installed, unable to hash posters. Please install it with 'pip install Pillow'")
+        return hashes
+    cache = load_cache()
+    pending = {}
+    for path in paths:
+        try:
+            file_fingerprint = fingerprint(path)
+        except OSError as e:
+            logger.warning(f"Unable to stat {path}: {e}")
+            continue
+        cached = cache.get(path)
+        if cached and cached[:2] == file_fingerprint:
+            hashes[path] = cached[2]
+        else:
+            pending[path] = file_fingerprint
+    if pending:
+        logger.debug(f"Hashing {len(pending)} posters, {len(hashes)} hashes loaded from cache")
+        pending_paths = list(pending)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(safe_dhash, pending_paths, chunksize=32)
+            for path, value in zip(pending_paths, results):
+                if value is None:
+                    logger.warning(f"Unable to hash {path}")
+                    continue
+                hashes[path] = value
+                cache[path] = pending[path] + [value]
+    for path in [path for path in cache if not os.path.exists(path)]:
+        del cache[path]
+    save_cache(cache)
+    return hashes
+
+
+def safe_dhash(path):
+    """
+    dhash that returns None for images that can't be read instead of failing the whole pool.
+    """
+    try:
+        return dhash(path)
+    except Exception:
+        return None
+
+
+class BKTree:
+    """
+    A BK-tree over hamming distance, used to find every hash within a distance of another without comparing all pairs.
+    """
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        """
+        Add a hash to the tree.
+        Parameters:
+            value (int): The hash.
+            item: The item the hash belongs to.
+        """
+        node = [value, [item], {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            if distance == 0:
+                current[1].append(item)
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value, max_distance):
+        """
+        Find every item whose hash is within max_distance of value.
+        Parameters:
+            value (int): The hash to search for.
+            max_distance (int): The maximum hamming distance.
+        Returns:
+            list: (distance, item) tuples.
+        """
+        results = []
+        if self.root is None:
+            return results
+        stack = [self.root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                results.extend((distance, item) for item in items)
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+
+def find_duplicates(hashes, threshold):
+    """
+    Group near-identical images into clusters.
+    Parameters:
+        hashes (dict): path -> hash
+        threshold (int): The maximum hamming distance for two images to be considered duplicates.
+    Returns:
+        list: A sorted list of clusters, each a sorted list of paths with more than one entry.
+    """
+    tree = BKTree()
+    for path, value in hashes.items():
+        tree.add(value, path)
+    parent = {path: path for path in hashes}
+
+    def find(path):
+        while parent[path] != path:
+            parent[path] = parent[parent[path]]
+            path = parent[path]
+        return path
+
+    for path, value in hashes.items():
+        for _, other in tree.search(value, threshold):
+            root, other_root = find(path), find(other)
+            if root != other_root:
+                parent[other_root] = root
+    clusters = {}
+    for path in hashes:
+        clusters.setdefault(find(path), []).append(path)
+    return sorted(sorted(cluster) for cluster in clusters.values() if len(cluster) > 1)
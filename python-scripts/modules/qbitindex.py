@@ -0,0 +1,140 @@
+import os
+import re
+import json
+import pathlib
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from qbittorrentapi import Client
+from qbittorrentapi.exceptions import APIError
+from unidecode import unidecode
+
+base_dir = pathlib.Path(__file__).parent.parent
+tmp_dir = f'{base_dir}/tmp'
+cache_path = f'{tmp_dir}/qbit_files.json'
+
+title_regex = re.compile(r".*\/([^/]+)\s\((\d{4})\).*")
+
+
+def tokens(text):
+    """
+    Split a name into lowercase words, ignoring punctuation and accents.
+    """
+    return re.findall(r'[a-z0-9]+', unidecode(text).lower())
+
+
+def load_cache():
+    """
+    Load the torrent file cache, the files of a torrent never change so they are cached by torrent hash.
+    The torrents of each client are kept too, to fall back on when a client can't be reached.
+    Returns:
+        dict: torrents -> {hash -> [[relative name, size], ...]}, clients -> {client name -> {hash -> torrent name}}
+    """
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    if 'torrents' not in cache:
+        # Caches from before clients were recorded only hold the torrent files
+        cache = {'torrents': cache, 'clients': {}}
+    return cache
+
+
+def save_cache(cache):
+    """
+    Save the torrent file cache.
+    Parameters:
+        cache (dict): The cache to save.
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    with open(f'{cache_path}.tmp', 'w') as f:
+        json.dump(cache, f)
+    os.replace(f'{cache_path}.tmp', cache_path)
+
+
+class TorrentIndex:
+    def __init__(self, logger, workers=8):
+        """
+        Initialize a TorrentIndex object, an index of every file in qBittorrent by size.
+        Used to tell if a media file is still being seeded when its hardlink count can't be trusted,
+        e.g. when the torrent lives on another filesystem.
+        Parameters:
+            logger (logging.Logger): a logger object for logging messages.
+            workers (int): The number of threads to use when fetching torrent files.
+        """
+        self.logger = logger
+        self.workers = workers
+        self.index = {}
+        self.cache = load_cache()
+        self.seen = {'torrents': {}, 'clients': {}}
+        self.unavailable = []
+
+    def add_client(self, name, url, username, password, categories=None):
+        """
+        Add the torrents of a qBittorrent instance to the index.
+        Parameters:
+            name (str): The name of the instance, used for logging.
+            url (str): The URL of the instance.
+            username (str): The username to log in with.
+            password (str): The password to log in with.
+            categories (list): Only index torrents in these categories, all torrents if not set.
+        """
+        url_parts = urlsplit(url)
+        cached = self.cache['torrents']
+        try:
+            qb = Client(host=url_parts.hostname, port=url_parts.port)
+            qb.auth_log_in(username=username, password=password)
+            torrents = [torrent for torrent in qb.torrents_info() if not categories or torrent['category'] in categories]
+            missing = [torrent['hash'] for torrent in torrents if torrent['hash'] not in cached]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for torrent_hash, files in zip(missing, executor.map(lambda torrent_hash: qb.torrents_files(torrent_hash=torrent_hash), missing)):
+                    cached[torrent_hash] = [[file['name'], file['size']] for file in files]
+        except APIError as e:
+            known = self.cache['clients'].get(name)
+            if known is None:
+                self.logger.error(f"Unable to index torrents in {name}: {e}")
+                self.unavailable.append(name)
+                return
+            # Files that may still be seeding from this client mustn't become eligible for deletion
+            self.logger.warning(f"Unable to reach {name}: {e}, using the {len(known)} torrents it had on the last run")
+            torrents = [{'hash': torrent_hash, 'name': torrent_name} for torrent_hash, torrent_name in known.items() if torrent_hash in cached]
+            missing = []
+        self.seen['clients'][name] = {torrent['hash']: torrent['name'] for torrent in torrents}
+        for torrent in torrents:
+            self.seen['torrents'][torrent['hash']] = cached[torrent['hash']]
+            for file_name, size in cached[torrent['hash']]:
+                self.index.setdefault(size, []).append((torrent['name'], file_name))
+        self.logger.debug(f"Indexed {len(torrents)} torrents from {name}, fetched the files of {len(missing)}")
+
+    def save(self):
+        """
+        Save the files of the torrents seen this run, removed torrents are dropped.
+        """
+        save_cache(self.seen)
+
+    def find(self, path):
+        """
+        Find a torrent that has a file with the same size and name as a media file.
+        The media file may have been renamed, so the name matches if the file names are the same or
+        every word of the title (and the year) of the media appears in the path inside the torrent.
+        Parameters:
+            path (str): The media file.
+        Returns:
+            str: The name of the torrent, or None if the file isn't in any torrent.
+        """
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        candidates = self.index.get(size)
+        if not candidates:
+            return None
+        file_name = os.path.basename(path).lower()
+        title_match = title_regex.match(path)
+        title_tokens = tokens(f"{title_match.group(1)} {title_match.group(2)}") if title_match else None
+        for torrent_name, torrent_file in candidates:
+            if os.path.basename(torrent_file).lower() == file_name:
+                return torrent_name
+            if title_tokens and set(title_tokens) <= set(tokens(torrent_file)):
+                return torrent_name
+        return None
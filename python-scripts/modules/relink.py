@@ -0,0 +1,146 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from modules.walker import Walker
+from modules.dircache import DirCache
+
+chunk_size = 1024 * 1024
+
+
+def load_settings(settings):
+    """
+    Merge the relink section of the config with the defaults.
+    Parameters:
+        settings (dict): The relink section of the config.
+    Returns:
+        dict: The settings to use.
+    """
+    settings = settings or {}
+    download_paths = settings.get('download_paths') or []
+    return {
+        'enabled': settings.get('enabled', False),
+        'download_paths': [download_paths] if isinstance(download_paths, str) else [path for path in download_paths if path],
+    }
+
+
+def partial_digest(path, size):
+    """
+    Get the sha1 digest of the first, middle and last chunk of a file, enough to tell most files of the same size apart.
+    Parameters:
+        path (str): The path of the file.
+        size (int): The size of the file.
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - chunk_size // 2), max(0, size - chunk_size)}):
+            f.seek(offset)
+            digest.update(f.read(chunk_size))
+    return digest.hexdigest()
+
+
+def full_digest(path):
+    """
+    Get the sha1 digest of a whole file.
+    Parameters:
+        path (str): The path of the file.
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Relinker:
+    def __init__(self, download_paths, logger, extensions=None, workers=8, use_cache=True):
+        """
+        Initialize a Relinker object, which finds identical copies of media files in the download directories.
+        The download directories are indexed by file size, only files with the same size are hashed.
+        Parameters:
+            download_paths (list): The directories the torrent client downloads to.
+            logger (logging.Logger): a logger object for logging messages.
+            extensions (list): Only index files ending with one of these extensions.
+            workers (int): The number of threads to use for scanning and hashing.
+            use_cache (bool): Whether or not to cache the download directory listings in the tmp folder.
+        """
+        self.logger = logger
+        self.workers = workers
+        self.digests = {}
+        dir_cache = DirCache("nohl_downloads", logger, use_cache, version=sorted(extensions or []))
+        walker = Walker(logger, extensions, workers, dir_cache)
+        self.index = {}
+        for entry in walker.walk(download_paths):
+            self.index.setdefault((entry.dev, entry.size), []).append(entry)
+        dir_cache.save()
+        self.logger.debug(f"Indexed {sum(len(entries) for entries in self.index.values())} files in the download directories")
+
+    def digest(self, kind, path, size):
+        """
+        Get a cached partial or full digest of a file.
+        """
+        key = (kind, path)
+        if key not in self.digests:
+            self.digests[key] = partial_digest(path, size) if kind == 'partial' else full_digest(path)
+        return self.digests[key]
+
+    def find_copy(self, path):
+        """
+        Find an identical copy of a file on the same filesystem.
+        Parameters:
+            path (str): The media file.
+        Returns:
+            str: The path of the copy, or None if there is none.
+        """
+        try:
+            stat = os.stat(path)
+            candidates = [entry for entry in self.index.get((stat.st_dev, stat.st_size), []) if entry.inode != stat.st_ino]
+            if not candidates:
+                return None
+            candidates = [entry for entry in candidates if self.digest('partial', entry.path, entry.size) == self.digest('partial', path, stat.st_size)]
+            for entry in candidates:
+                if self.digest('full', entry.path, entry.size) == self.digest('full', path, stat.st_size):
+                    return entry.path
+        except OSError as e:
+            self.logger.warning(f"Error comparing {path} with the download directories. Error: {e}")
+        return None
+
+    def relink(self, files, dry_run):
+        """
+        Replace every media file that has an identical copy in the download directories with a hardlink to that copy.
+        The hardlink is created next to the media file and renamed over it, so the media file is never missing.
+        Parameters:
+            files (list): The media files that are not hardlinked.
+            dry_run (bool): Whether or not to only log what would be relinked.
+        Returns:
+            list: The files that could not be relinked.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            copies = list(executor.map(self.find_copy, files))
+        remaining = []
+        relinked = 0
+        for path, copy in zip(files, copies):
+            if copy is None:
+                remaining.append(path)
+                continue
+            if dry_run:
+                self.logger.info(f"Would have relinked {path} to {copy}")
+                relinked += 1
+                continue
+            tmp_path = f'{path}.nohl.tmp'
+            try:
+                os.link(copy, tmp_path)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                self.logger.error(f"Error relinking {path} to {copy}. Error: {e}")
+                if os.path.lexists(tmp_path):
+                    os.remove(tmp_path)
+                remaining.append(path)
+                continue
+            self.logger.info(f"Relinked {path} to {copy}")
+            relinked += 1
+        self.logger.info(f"{'Would have relinked' if dry_run else 'Relinked'} {relinked} files, {len(remaining)} files have no copy in the download directories")
+        return remaining
@@ -0,0 +1,93 @@
+import os
+import csv
+import json
+import pathlib
+
+base_dir = pathlib.Path(__file__).parent.parent
+tmp_dir = f'{base_dir}/tmp'
+
+report_formats = {
+    'jsonl': '.jsonl',
+    'csv': '.csv',
+}
+
+
+class ReportWriter:
+    def __init__(self, path, report_format, fields):
+        """
+        Initialize a ReportWriter object, rows are written to the file as they are produced.
+        Parameters:
+            path (str): The path of the report without an extension.
+            report_format (str): 'jsonl' or 'csv'.
+            fields (list): The fields of each row, used for the CSV header.
+        Raises:
+            ValueError: If the report format is unknown.
+        """
+        if report_format not in report_formats:
+            raise ValueError(f"Unknown report format: {report_format}, options are {', '.join(report_formats)}")
+        self.report_format = report_format
+        self.path = f'{path}{report_formats[report_format]}'
+        self.fields = fields
+        self.count = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(f'{self.path}.tmp', 'w', newline='', encoding='utf-8')
+        if report_format == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=fields, extrasaction='ignore')
+            self.writer.writeheader()
+
+    def write(self, row):
+        """
+        Write a single row.
+        Parameters:
+            row (dict): The row to write.
+        """
+        if self.report_format == 'csv':
+            self.writer.writerow({key: json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else value for key, value in row.items()})
+        else:
+            self.file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self):
+        """
+        Close the report, the report only replaces the previous one once it has been fully written.
+        """
+        self.file.close()
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(f'{self.path}.tmp')
+
+
+def load_state(name):
+    """
+    Load the set of row keys from the previous run.
+    Parameters:
+        name (str): The name of the state, used for the file name in the tmp folder.
+    Returns:
+        set: The keys, or None if there is no previous run.
+    """
+    try:
+        with open(f'{tmp_dir}/{name}.json', 'r') as f:
+            return set(tuple(key) for key in json.load(f))
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(name, keys):
+    """
+    Save the set of row keys for the next run.
+    Parameters:
+        name (str): The name of the state, used for the file name in the tmp folder.
+        keys (set): The keys to save.
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    with open(f'{tmp_dir}/{name}.json.tmp', 'w') as f:
+        json.dump(sorted(keys), f, ensure_ascii=False)
+    os.replace(f'{tmp_dir}/{name}.json.tmp', f'{tmp_dir}/{name}.json')
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import bisect
+import hashlib
+import pathlib
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+base_dir = pathlib.Path(__file__).parent.parent
+tmp_dir = f'{base_dir}/tmp'
+
+
+def formats_version(custom_formats):
+    """
+    Get a digest of the custom format definitions, cached memberships are only valid while the definitions don't change.
+    Parameters:
+        custom_formats (list): The custom formats from the Arr instance.
+    Returns:
+        str: The hex digest.
+    """
+    return hashlib.sha1(json.dumps(custom_formats, sort_keys=True).encode()).hexdigest()
+
+
+def load_cache(name, version):
+    """
+    Load the custom formats of each file from the last run.
+    Parameters:
+        name (str): The name of the cache, used for the file name in the tmp folder.
+        version (str): The digest of the custom format definitions, the cache is dropped if it has changed.
+    Returns:
+        dict: file id (as a string) -> list of custom format names
+    """
+    try:
+        with open(f'{tmp_dir}/{name}.json', 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('version') != version:
+        return {}
+    return data.get('files', {})
+
+
+def save_cache(name, version, files):
+    """
+    Save the custom formats of each file.
+    Parameters:
+        name (str): The name of the cache, used for the file name in the tmp folder.
+        version (str): The digest of the custom format definitions.
+        files (dict): file id (as a string) -> list of custom format names
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    with open(f'{tmp_dir}/{name}.json.tmp', 'w') as f:
+        json.dump({'version': version, 'files': files}, f)
+    os.replace(f'{tmp_dir}/{name}.json.tmp', f'{tmp_dir}/{name}.json')
+
+
+class ScoringEngine:
+    def __init__(self, memberships):
+        """
+        Initialize a ScoringEngine object, custom format membership is stored as an item x format matrix
+        so every item can be scored against any number of profiles with a single matrix product.
+        Falls back to plain Python when NumPy isn't installed, and to a dense matrix when SciPy isn't.
+        Parameters:
+            memberships (dict): item id -> list of custom format names
+        """
+        self.ids = list(memberships)
+        self.memberships = memberships
+        self.formats = sorted({name for names in memberships.values() for name in names})
+        self.matrix = None
+        if np is None:
+            return
+        columns = {name: column for column, name in enumerate(self.formats)}
+        rows = []
+        cols = []
+        for row, item_id in enumerate(self.ids):
+            for name in set(memberships[item_id]):
+                rows.append(row)
+                cols.append(columns[name])
+        shape = (len(self.ids), len(self.formats))
+        if sparse is not None:
+            self.matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=shape)
+        else:
+            self.matrix = np.zeros(shape, dtype=np.int64)
+            self.matrix[rows, cols] = 1
+
+    def score(self, profiles):
+        """
+        Score every item against every profile.
+        Parameters:
+            profiles (list): A dict of custom format name -> score for each profile.
+        Returns:
+            dict: item id -> list with the score for each profile, in the order of profiles.
+        """
+        if self.matrix is None:
+            return {item_id: [sum(profile.get(name, 0) for name in set(names)) for profile in profiles] for item_id, names in self.memberships.items()}
+        vectors = np.array([[profile.get(name, 0) for profile in profiles] for name in self.formats], dtype=np.int64).reshape(len(self.formats), len(profiles))
+        scores = np.asarray(self.matrix @ vectors)
+        return dict(zip(self.ids, scores.tolist()))
+
+
+class ScoreDistribution:
+    def __init__(self, profiles):
+        """
+        Initialize a ScoreDistribution object, a histogram of the scores of every item for each profile.
+        Custom format scores only take a handful of distinct values, so the histogram stays small however large the library is
+        and the number of items at or below any threshold can be answered from it without scoring anything again.
+        Parameters:
+            profiles (list): The names of the profiles, in the order the scores are added in.
+        """
+        self.profiles = list(profiles)
+        self.histograms = [Counter() for _ in self.profiles]
+        self.total = 0
+        self.created = time.time()
+
+    def add(self, scores):
+        """
+        Add the scores of an item.
+        Parameters:
+            scores (list): The score of the item for each profile.
+        """
+        self.total += 1
+        for histogram, score in zip(self.histograms, scores):
+            histogram[score] += 1
+
+    def cdf(self, profile):
+        """
+        Get the cumulative distribution of a profile.
+        Parameters:
+            profile (int): The index of the profile.
+        Returns:
+            list: The distinct scores in ascending order and the number of items at or below each of them.
+        """
+        scores = sorted(self.histograms[profile])
+        cumulative = []
+        count = 0
+        for score in scores:
+            count += self.histograms[profile][score]
+            cumulative.append(count)
+        return [scores, cumulative]
+
+    def count_below(self, profile, threshold):
+        """
+        Count the items at or below a threshold.
+        Parameters:
+            profile (int): The index of the profile.
+            threshold (int): The threshold.
+        Returns:
+            int: The number of items.
+        """
+        scores, cumulative = self.cdf(profile)
+        index = bisect.bisect_right(scores, threshold)
+        return cumulative[index - 1] if index else 0
+
+    def to_dict(self):
+        return {
+            'created': self.created,
+            'total': self.total,
+            'profiles': self.profiles,
+            'histograms': [sorted(histogram.items()) for histogram in self.histograms],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        distribution = cls(data['profiles'])
+        distribution.created = data['created']
+        distribution.total = data['total']
+        distribution.histograms = [Counter({score: count for score, count in histogram}) for histogram in data['histograms']]
+        return distribution
+
+
+def save_distribution(name, distribution):
+    """
+    Save a score distribution to the tmp folder.
+    Parameters:
+        name (str): The name of the distribution, used for the file name in the tmp folder.
+        distribution (ScoreDistribution): The distribution to save.
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    with open(f'{tmp_dir}/{name}.json.tmp', 'w') as f:
+        json.dump(distribution.to_dict(), f)
+    os.replace(f'{tmp_dir}/{name}.json.tmp', f'{tmp_dir}/{name}.json')
+
+
+def load_distribution(name):
+    """
+    Load a score distribution saved by an earlier run.
+    Parameters:
+        name (str): The name of the distribution.
+    Returns:
+        ScoreDistribution: The distribution, or None if there isn't one.
+    """
+    try:
+        with open(f'{tmp_dir}/{name}.json', 'r') as f:
+            return ScoreDistribution.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError):
+        return None
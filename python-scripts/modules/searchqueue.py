@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import pathlib
+import sqlite3
+
+base_dir = pathlib.Path(__file__).parent.parent
+tmp_dir = f'{base_dir}/tmp'
+
+
+def connect(path):
+    """
+    Open a SQLite database in autocommit mode, transactions are started explicitly where needed.
+    Parameters:
+        path (str): The path of the database.
+    Returns:
+        sqlite3.Connection: The connection.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+
+
+class SearchQueue:
+    def __init__(self, name):
+        """
+        Initialize a SearchQueue object, a durable queue of pending jobs stored in the tmp folder.
+        Jobs are identified by a key, pushing a job that is already queued updates it but keeps its place in the queue.
+        Parameters:
+            name (str): The name of the queue, used for the file name in the tmp folder.
+        """
+        self.path = f'{tmp_dir}/{name}.db'
+        self.connection = connect(self.path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, instance TEXT, priority INTEGER, added REAL, payload TEXT)")
+
+    def push(self, key, instance, priority, payload):
+        """
+        Add a job to the queue, or update it if it is already queued.
+        Parameters:
+            key (str): The key of the job.
+            instance (str): The name of the instance the job belongs to.
+            priority (int): Jobs with a lower priority are run first, jobs with the same priority oldest first.
+            payload (dict): The job itself.
+        Returns:
+            bool: True if the job is new.
+        """
+        data = json.dumps(payload)
+        # The connection is in autocommit mode, the update and insert need an explicit transaction to be atomic
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = self.connection.execute("UPDATE jobs SET priority = ?, payload = ? WHERE key = ?", (priority, data, key))
+            added = not cursor.rowcount
+            if added:
+                self.connection.execute("INSERT INTO jobs (key, instance, priority, added, payload) VALUES (?, ?, ?, ?, ?)", (key, instance, priority, time.time(), data))
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        return added
+
+    def jobs(self):
+        """
+        Get every queued job in the order it should be run.
+        Returns:
+            list: (key, instance, payload) tuples.
+        """
+        rows = self.connection.execute("SELECT key, instance, payload FROM jobs ORDER BY priority, added").fetchall()
+        return [(key, instance, json.loads(payload)) for key, instance, payload in rows]
+
+    def remove(self, key):
+        """
+        Remove a job from the queue.
+        Parameters:
+            key (str): The key of the job.
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM jobs WHERE key = ?", (key,))
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+
+class TokenBucket:
+    def __init__(self, name, capacity, per_hour, path=None):
+        """
+        Initialize a TokenBucket object, a rate limit that is persisted between runs and shared by everything using the same name.
+        The bucket holds up to capacity tokens and refills at per_hour tokens an hour.
+        Parameters:
+            name (str): The name of the bucket.
+            capacity (int): The maximum number of tokens.
+            per_hour (float): The number of tokens added back every hour.
+            path (str): The database to store the bucket in, defaults to rate_limits.db in the tmp folder.
+        """
+        self.name = name
+        self.capacity = capacity
+        self.rate = per_hour / 3600
+        self.connection = connect(path or f'{tmp_dir}/rate_limits.db')
+        self.connection.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def refill(self):
+        """
+        Get the current number of tokens, must be called inside a transaction.
+        """
+        now = time.time()
+        row = self.connection.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+        if row is None:
+            return self.capacity, now
+        tokens, updated = row
+        return min(self.capacity, tokens + max(0, now - updated) * self.rate), now
+
+    def available(self):
+        """
+        Get the number of whole tokens available.
+        """
+        tokens, _ = self.refill()
+        return int(tokens)
+
+    def take(self, count=1):
+        """
+        Take tokens from the bucket if there are enough.
+        Parameters:
+            count (int): The number of tokens to take.
+        Returns:
+            bool: True if the tokens were taken.
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            tokens, now = self.refill()
+            taken = tokens >= count
+            if taken:
+                tokens -= count
+            self.connection.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (self.name, tokens, now))
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        return taken
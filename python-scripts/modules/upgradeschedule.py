@@ -0,0 +1,119 @@
+import json
+import time
+import pathlib
+from modules.searchqueue import connect
+
+base_dir = pathlib.Path(__file__).parent.parent
+tmp_dir = f'{base_dir}/tmp'
+
+
+class UpgradeSchedule:
+    def __init__(self, name):
+        """
+        Initialize an UpgradeSchedule object, a record of when each item was last searched for an upgrade and what came of it.
+        The file of an item is remembered when it is searched, if it has changed by a later run the search found an upgrade.
+        The items searched in each run are kept as well, to follow them through to grabs and imports.
+        Parameters:
+            name (str): The name of the schedule, used for the file name in the tmp folder.
+        """
+        self.path = f'{tmp_dir}/{name}.db'
+        self.connection = connect(self.path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS searches (instance TEXT, media_id INTEGER, last_searched REAL, searches INTEGER, signature TEXT, result TEXT, PRIMARY KEY (instance, media_id))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS runs (instance TEXT, started REAL, media_ids TEXT)")
+
+    def history(self, instance):
+        """
+        Get the search history of an instance.
+        Parameters:
+            instance (str): The name of the instance.
+        Returns:
+            dict: media id -> dict with last_searched, searches, signature and result
+        """
+        rows = self.connection.execute("SELECT media_id, last_searched, searches, signature, result FROM searches WHERE instance = ?", (instance,)).fetchall()
+        return {media_id: {'last_searched': last_searched, 'searches': searches, 'signature': signature, 'result': result} for media_id, last_searched, searches, signature, result in rows}
+
+    def update_results(self, instance, signatures, complete=True):
+        """
+        Mark the items whose file has changed since they were searched as upgraded, and forget the items that are gone.
+        Parameters:
+            instance (str): The name of the instance.
+            signatures (dict): media id -> the current signature of its files
+            complete (bool): Whether signatures covers the whole library. If it only covers the items below their cutoff,
+                             searched items that are missing from it have been upgraded rather than removed.
+        Returns:
+            int: The number of items upgraded since the last run.
+        """
+        upgraded = []
+        removed = []
+        for media_id, entry in self.history(instance).items():
+            if media_id not in signatures:
+                if complete:
+                    removed.append((instance, media_id))
+                elif entry['result'] == 'searched':
+                    upgraded.append((entry['signature'], instance, media_id))
+            elif entry['result'] == 'searched' and self.replaced(entry['signature'], signatures[media_id]):
+                upgraded.append((signatures[media_id], instance, media_id))
+        with self.connection:
+            self.connection.executemany("UPDATE searches SET signature = ?, result = 'upgraded' WHERE instance = ? AND media_id = ?", upgraded)
+            self.connection.executemany("DELETE FROM searches WHERE instance = ? AND media_id = ?", removed)
+        return len(upgraded)
+
+    @staticmethod
+    def replaced(searched, current):
+        """
+        Check whether a file an item had when it was searched has been replaced.
+        Files added since the search, like new episodes of a series, don't count.
+        Parameters:
+            searched (str): The signature when the item was searched, the comma separated IDs of its files.
+            current (str): The signature now.
+        Returns:
+            bool: True if the item has been upgraded.
+        """
+        if current is None:
+            return False
+        if searched is None:
+            return True
+        if ':' in searched:
+            # Signatures from before file IDs were used can't be compared, the next search records a new one
+            return False
+        return bool(set(searched.split(',')) - set(current.split(',')))
+
+    def record(self, instance, signatures):
+        """
+        Record that items have been searched.
+        Parameters:
+            instance (str): The name of the instance.
+            signatures (dict): media id -> the signature of its files at the time of the search
+        """
+        now = time.time()
+        # A single statement per item, instances share the database and may record the same item at the same time
+        with self.connection:
+            self.connection.executemany("INSERT INTO searches (instance, media_id, last_searched, searches, signature, result) VALUES (?, ?, ?, 1, ?, 'searched') "
+                                        "ON CONFLICT (instance, media_id) DO UPDATE SET last_searched = excluded.last_searched, searches = searches + 1, signature = excluded.signature, result = 'searched'",
+                                        [(instance, media_id, now, signature) for media_id, signature in signatures.items()])
+
+    def add_run(self, instance, started, media_ids, keep=30):
+        """
+        Record the items searched in a run.
+        Parameters:
+            instance (str): The name of the instance.
+            started (float): The time the run started.
+            media_ids (list): The IDs of the items searched.
+            keep (int): The number of runs to keep for each instance.
+        """
+        with self.connection:
+            self.connection.execute("INSERT INTO runs (instance, started, media_ids) VALUES (?, ?, ?)", (instance, started, json.dumps(media_ids)))
+            self.connection.execute("DELETE FROM runs WHERE instance = ? AND started NOT IN (SELECT started FROM runs WHERE instance = ? ORDER BY started DESC LIMIT ?)", (instance, instance, keep))
+
+    def last_run(self, instance):
+        """
+        Get the last run of an instance that searched anything.
+        Parameters:
+            instance (str): The name of the instance.
+        Returns:
+            tuple: The time the run started and the IDs of the items searched, or None if there hasn't been one.
+        """
+        row = self.connection.execute("SELECT started, media_ids FROM runs WHERE instance = ? ORDER BY started DESC LIMIT 1", (instance,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
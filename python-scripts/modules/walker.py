@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import queue
+import threading
+from collections import namedtuple
+from tqdm import tqdm
+
+FileEntry = namedtuple('FileEntry', ['root', 'path', 'dev', 'inode', 'size', 'mtime', 'nlink'])
+
+
+def list_dir(path):
+    """
+    List a directory with a single scandir pass, using the entry types returned by scandir instead of a stat per entry.
+    Parameters:
+        path (str): The directory to list.
+    Returns:
+        list: A sorted list of folder names and a sorted list of file names.
+    Raises:
+        OSError: If the directory can't be read.
+    """
+    folders = []
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                folders.append(entry.name)
+            else:
+                files.append(entry.name)
+    return [sorted(folders), sorted(files)]
+
+
+class Walker:
+    def __init__(self, logger, extensions=None, workers=8, dir_cache=None):
+        """
+        Initialize a Walker object, a multithreaded replacement for os.walk.
+        Directories are put on a shared frontier that every worker takes from, so one large root
+        doesn't leave the other workers idle.
+        Parameters:
+            logger (logging.Logger): a logger object for logging messages.
+            extensions (list): Only return files ending with one of these extensions, all files if not set.
+            workers (int): The number of threads to use.
+            dir_cache (DirCache): When set, directories that haven't changed since the last walk are not read again.
+        """
+        self.logger = logger
+        self.extensions = tuple(extension.lower() for extension in extensions) if extensions else None
+        self.workers = max(1, workers or 1)
+        self.dir_cache = dir_cache
+        self.complete = True
+
+    def matches(self, name):
+        """
+        Check if a file name has one of the extensions to return.
+        """
+        return self.extensions is None or name.lower().endswith(self.extensions)
+
+    def read_dir(self, path):
+        """
+        Read a single directory. Symlinks are not followed and the stat of each matching file
+        comes from the scandir entry.
+        Parameters:
+            path (str): The directory to read.
+        Returns:
+            list: The sub directories and a [path, dev, inode, size, mtime, nlink] list for each matching file.
+        Raises:
+            OSError: If the directory can't be read.
+        """
+        dirs = []
+        files = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and self.matches(entry.name):
+                        stat = entry.stat(follow_symlinks=False)
+                        files.append([entry.path, stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_nlink])
+                except OSError as e:
+                    self.logger.warning(f"Error processing file: {entry.path}. Error: {e}")
+        return [dirs, files]
+
+    def scan(self, root, path):
+        """
+        Scan a single directory, reusing the cached result if the directory hasn't changed.
+        Parameters:
+            root (str): The root the directory belongs to.
+            path (str): The directory to scan.
+        Returns:
+            list: The sub directories.
+            list: A FileEntry for each matching file.
+        Raises:
+            OSError: If the directory can't be read.
+        """
+        if self.dir_cache is not None:
+            scanned = []
+            def read_dir(path):
+                scanned.append(path)
+                return self.read_dir(path)
+            dirs, files = self.dir_cache.get_or_scan(path, read_dir)
+            if not scanned:
+                files = self.refresh(files)
+        else:
+            dirs, files = self.read_dir(path)
+        return dirs, [FileEntry(root, *file) for file in files]
+
+    def refresh(self, files):
+        """
+        Stat the files of a cached directory again. Adding or removing a hardlink to a file changes its link count
+        but not the mtime of the directory, so the cached link counts can't be trusted.
+        Parameters:
+            files (list): The cached [path, dev, inode, size, mtime, nlink] lists.
+        Returns:
+            list: The lists with the current stat of each file, files that are gone are left out.
+        """
+        refreshed = []
+        for file in files:
+            try:
+                stat = os.stat(file[0], follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                self.logger.warning(f"Error processing file: {file[0]}. Error: {e}")
+                continue
+            refreshed.append([file[0], stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_nlink])
+        return refreshed
+
+    def load_checkpoint(self, checkpoint, roots):
+        """
+        Load the directories left to scan and the files found so far by a walk that ran out of time.
+        Parameters:
+            checkpoint (str): The path of the checkpoint.
+            roots (list): The directories being walked, a checkpoint for other directories is ignored.
+        Returns:
+            list: [root, path] pairs left to scan and the FileEntry found so far, or None if there is no checkpoint.
+        """
+        try:
+            with open(checkpoint, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('roots') != roots:
+            return None
+        return data['frontier'], [FileEntry(*entry) for entry in data['results']]
+
+    def save_checkpoint(self, checkpoint, roots, frontier, results):
+        """
+        Save the directories left to scan and the files found so far, or remove the checkpoint once the walk is complete.
+        """
+        if not frontier:
+            if os.path.exists(checkpoint):
+                os.remove(checkpoint)
+            return
+        os.makedirs(os.path.dirname(checkpoint), exist_ok=True)
+        with open(f'{checkpoint}.tmp', 'w') as f:
+            json.dump({'roots': roots, 'frontier': frontier, 'results': results}, f)
+        os.replace(f'{checkpoint}.tmp', checkpoint)
+
+    def walk(self, roots, deadline=None, checkpoint=None):
+        """
+        Walk every root and return the matching files.
+        When a deadline is set the walk stops once it passes and self.complete is set to False, with a checkpoint
+        the remaining directories and the files found so far are saved and the next walk carries on from there.
+        Parameters:
+            roots (list): The directories to walk.
+            deadline (float): A time.time() after which no new directories are scanned.
+            checkpoint (str): The path to save the progress of an incomplete walk to.
+        Returns:
+            list: A FileEntry for each matching file, sorted by path.
+        """
+        roots = list(dict.fromkeys(roots))
+        frontier = queue.Queue()
+        lock = threading.Lock()
+        results = []
+        leftover = []
+        pending = {}
+        progress = {}
+        resumed = self.load_checkpoint(checkpoint, roots) if checkpoint else None
+        if resumed:
+            start, results = resumed
+            self.logger.info(f"Resuming scan, {len(start)} directories left and {len(results)} files found so far")
+        else:
+            start = []
+            for root in roots:
+                if not os.path.isdir(root):
+                    self.logger.warning(f"Error processing directory: {root}. Error: not a directory")
+                    continue
+                start.append([root, root])
+        for root, path in start:
+            if root not in pending:
+                self.logger.info(f"Processing directory: {root}")
+                pending[root] = 0
+                progress[root] = {'dirs': 0, 'files': 0}
+            pending[root] += 1
+            frontier.put((root, path))
+        progress_bar = tqdm(desc="Scanning directories", unit=" dirs", disable=None)
+
+        def worker():
+            while True:
+                item = frontier.get()
+                if item is None:
+                    frontier.task_done()
+                    return
+                root, path = item
+                # task_done must always be called or frontier.join() never returns
+                try:
+                    if deadline is not None and time.time() >= deadline:
+                        # Out of time, the rest of the frontier is drained into the checkpoint
+                        with lock:
+                            leftover.append([root, path])
+                        continue
+                    try:
+                        dirs, files = self.scan(root, path)
+                    except OSError as e:
+                        self.logger.warning(f"Error processing directory: {path}. Error: {e}")
+                        dirs, files = [], []
+                    with lock:
+                        for directory in dirs:
+                            frontier.put((root, directory))
+                        results.extend(files)
+                        pending[root] += len(dirs) - 1
+                        progress[root]['dirs'] += 1
+                        progress[root]['files'] += len(files)
+                        progress_bar.update(1)
+                        if pending[root] == 0:
+                            self.logger.debug(f"Finished {root}: {progress[root]['dirs']} directories, {progress[root]['files']} files")
+                except Exception as e:
+                    self.logger.error(f"Unexpected error processing directory: {path}. Error: {e}", exc_info=True)
+                finally:
+                    frontier.task_done()
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        frontier.join()
+        for _ in threads:
+            frontier.put(None)
+        for thread in threads:
+            thread.join()
+        progress_bar.close()
+        self.complete = not leftover
+        if leftover:
+            self.logger.info(f"Scan stopped with {len(leftover)} directories left")
+        if checkpoint:
+            self.save_checkpoint(checkpoint, roots, leftover, results)
+        return sorted(results, key=lambda entry: entry.path)
@@ -11,9 +11,9 @@
 # Description: This script will find all files that are not hardlinked and will process them in Radarr
 #              and Sonarr. This is useful for finding files that are not hardlinked and wish to have 100%
 #              hardlinks seeding.
-# Usage: python3 nohl.py
-# Requirements: Python 3.8+, requests
-# Version: 1.0.3
+# Usage: python3 nohl.py [--time-budget MINUTES]
+# Requirements: Python 3.8+, requests, qbittorrentapi
+# Version: 2.2.0
 # License: MIT License
 # ===================================================================================================
 
@@ -24,43 +24,78 @@ import sys
 import time
 import json
 import re
+import argparse
+import requests
 from modules.config import Config
 from modules.logger import setup_logger
 from modules.arrpy import StARR
+from modules.walker import Walker
+from modules.dircache import DirCache
+from modules.report import load_state, save_state
+from modules import relink
+from modules.pathtrie import PathTrie
+from modules.searchqueue import SearchQueue, TokenBucket
+from modules.qbitindex import TorrentIndex
 from unidecode import unidecode
 
 config = Config(script_name="nohl")
 logger = setup_logger(config.log_level, "nohl")
+# Searches that didn't fit in the budget are kept for the next run, the budget refills maximum_searches an hour
+search_queue = SearchQueue("nohl_queue")
+search_budget = TokenBucket("nohl_searches", config.maximum_searches, config.maximum_searches)
 
+walker_checkpoint_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp')
 illegal_chars_regex = re.compile(r"[^\w\s\-\(\)/.'’]+")
 season_regex = r"(?i)S(\d{2})E"
 episode_regex = r"(?:E|e)(\d{1,2})"
 title_regex = r".*\/([^/]+)\s\((\d{4})\).*"
 
-def find_no_hl_files(media_paths):
-    no_hl_files = []
-    for dir in media_paths:
-        try:
-            logger.info(f"Processing directory: {dir}")
-            for root, dirs, files in os.walk(dir):
-                for file in files:
-                    try:
-                        if file.endswith(".mkv") or file.endswith(".mp4"):
-                            file_path = os.path.join(root, file)
-                            if (os.path.isfile(file_path) and os.stat(file_path).st_nlink == 1):
-                                no_hl_files.append(file_path)
-                    except Exception as e:
-                        logger.warning(f"Error processing file: {file}. Error: {e}")
-        except Exception as e:
-            logger.warning(f"Error processing directory: {dir}. Error: {e}")
+def find_no_hl_files(media_paths, deadline=None):
+    # Only directories whose mtime changed are re-read. A file losing its other link (e.g. the torrent being removed)
+    # doesn't touch the media directory, so the files of cached directories are still stat'ed on every run
+    dir_cache = DirCache("nohl_index", logger, config.use_cache, version=sorted(config.extensions))
+    walker = Walker(logger, config.extensions, config.workers, dir_cache)
+    entries = walker.walk(media_paths, deadline, f'{walker_checkpoint_dir}/nohl_checkpoint.json')
+    dir_cache.save(keep_unseen=not walker.complete)
+    if not walker.complete:
+        logger.info("Time budget reached, the scan will carry on from where it stopped on the next run")
+        return []
+    no_hl_files = [entry.path for entry in entries if entry.nlink == 1]
+    previous_files = load_state("nohl_files")
+    save_state("nohl_files", set((file,) for file in no_hl_files))
+    if previous_files is not None:
+        new_files = [file for file in no_hl_files if (file,) not in previous_files]
+        logger.info(f"Found {len(no_hl_files)} files that are not hardlinked, {len(new_files)} of them are new since the last run")
+        for file in new_files:
+            logger.info(f"\tNew: {file}")
     return no_hl_files
 
-def process_instances(instance_type, url, api, nohl_files, include_profiles, exclude_profiles, dry_run, exclude_series):
-    nohl_files.sort()
+def remove_seeding_files(nohl_files):
+    # A link count of 1 doesn't always mean the file isn't seeding, the torrent may be on another filesystem or have been moved
+    torrent_index = TorrentIndex(logger, config.workers)
+    for item in config.qbit:
+        qbit_data = next((data for data in config.qbit_data if data['name'] == item['name']), None)
+        if qbit_data is None:
+            logger.error(f"qBittorrent instance {item['name']} not found in the global config")
+            continue
+        categories = item.get('categories')
+        torrent_index.add_client(item['name'], qbit_data['url'], qbit_data['username'], qbit_data['password'], [categories] if isinstance(categories, str) else categories)
+    torrent_index.save()
+    if torrent_index.unavailable:
+        # Nothing is known about the torrents of these clients, any of the files could be seeding from them
+        logger.warning(f"Unable to check {', '.join(torrent_index.unavailable)}, not acting on any files that aren't hardlinked this run")
+        return []
+    remaining = []
+    for file in nohl_files:
+        torrent_name = torrent_index.find(file)
+        if torrent_name:
+            logger.info(f"Skipping {file} because it is still seeding in qBittorrent as {torrent_name}")
+        else:
+            remaining.append(file)
+    return remaining
+
+def parse_files(instance_type, nohl_files):
     media_data = []
-    media_data_episodes = []
-    app = StARR(url, api, logger)
-    media = app.get_media()
     title = None
     year = None
     season_number = None
@@ -75,7 +110,7 @@ def process_instances(instance_type, url, api, nohl_files, include_profiles, exc
                     year = int(title_match.group(2))
             except Exception as e:
                 logger.warning(f"Error processing file: {file}. Error: {e}")
-            labled_data = {'title': title, 'year': year}
+            labled_data = {'title': title, 'year': year, 'files': [file]}
             media_data.append(labled_data)
     if instance_type == 'Sonarr':
         for file in nohl_files:
@@ -106,15 +141,7 @@ def process_instances(instance_type, url, api, nohl_files, include_profiles, exc
                     season_number_modified = int(season_number)
             existing_dict = next((d for d in media_data if d['title'] == title and d['year'] == year), None)
             if existing_dict:
-                for season_info in existing_dict['season_info']:
-                    if season_info['season_number'] == season_number_modified:
-                        season_info['episodes'].append(episode)
-                        break
-                else:
-                    existing_dict['season_info'].append({
-                        'season_number': season_number_modified, 
-                        'episodes': [episode]
-                    })
+                add_episodes(existing_dict, season_number_modified, [episode], [file])
             else:
                 try:
                     media_data.append({
@@ -122,212 +149,409 @@ def process_instances(instance_type, url, api, nohl_files, include_profiles, exc
                         'year': year, 
                         'season_info': [{
                             'season_number': season_number_modified, 
-                            'episodes': [episode]
+                            'episodes': [episode],
+                            'files': [file]
                         }]
                     })
                 except Exception as e:
                     logger.warning(f"Error processing file: {file}. Error: {e}")
-    logger.debug(f"Media Data: {json.dumps(media_data, indent=4)}")
-    results = []
-    file_ids = []
-    quality_profiles = []
-    quality_profiles = app.get_quality_profile_names()
+    return media_data
+
+def add_episodes(media_data_item, season_number, episodes, files):
+    for season_info in media_data_item['season_info']:
+        if season_info['season_number'] == season_number:
+            season_info['episodes'].extend(episodes)
+            season_info['files'].extend(files)
+            break
+    else:
+        media_data_item['season_info'].append({
+            'season_number': season_number, 
+            'episodes': list(episodes),
+            'files': list(files)
+        })
+
+def add_match(matches, media_item, media_data_item):
+    # Files of the same media found by path and by title are merged so the media is only processed once
+    existing = matches.get(media_item['id'])
+    if existing is None:
+        matches[media_item['id']] = (media_data_item, media_item)
+    elif 'season_info' in media_data_item:
+        for season_info in media_data_item['season_info']:
+            add_episodes(existing[0], season_info['season_number'], season_info['episodes'], season_info['files'])
+    else:
+        existing[0]['files'].extend(media_data_item['files'])
+
+def resolve_paths(app, instance_type, media, nohl_files, season_data):
+    """
+    Resolve files to media by their exact path using the file records of the Arr instance.
+    Parameters:
+        app (StARR): The Arr instance.
+        instance_type (str): 'Radarr' or 'Sonarr'.
+        media (list): The media from get_media().
+        nohl_files (list): The files that are not hardlinked.
+        season_data (dict): Filled with the episodes of every series that is looked up, by series id.
+    Returns:
+        dict: media id -> (media data, media item) for the files that were resolved.
+        list: The files that could not be resolved, e.g. because the Arr instance sees them under a different path.
+    """
+    matches = {}
+    unresolved = []
+    if instance_type == 'Radarr':
+        movies_by_path = {os.path.normpath(item['movieFile']['path']): item for item in media if item.get('movieFile', {}).get('path')}
+        for file in nohl_files:
+            media_item = movies_by_path.get(os.path.normpath(file))
+            if media_item is None:
+                unresolved.append(file)
+                continue
+            add_match(matches, media_item, {'title': media_item['title'], 'year': media_item['year'], 'files': [file]})
+    elif instance_type == 'Sonarr':
+        series_by_path = {os.path.normpath(item['path']): item for item in media if item.get('path')}
+        files_by_series = {}
+        for file in nohl_files:
+            parent = os.path.dirname(os.path.normpath(file))
+            while parent not in series_by_path and os.path.dirname(parent) != parent:
+                parent = os.path.dirname(parent)
+            media_item = series_by_path.get(parent)
+            if media_item is None:
+                unresolved.append(file)
+                continue
+            files_by_series.setdefault(media_item['id'], (media_item, []))[1].append(file)
+        # One request per series returns its episodes with their files, the series are fetched at the same time
+        for media_item_id, episodes in app.iter_season_data(list(files_by_series), config.workers, include_episode_file=True):
+            media_item, files = files_by_series[media_item_id]
+            season_data[media_item_id] = episodes
+            episodes_by_path = {}
+            for episode in episodes:
+                if episode.get('episodeFileId') and (episode.get('episodeFile') or {}).get('path'):
+                    episodes_by_path.setdefault(os.path.normpath(episode['episodeFile']['path']), []).append(episode)
+            for file in files:
+                file_episodes = episodes_by_path.get(os.path.normpath(file))
+                if not file_episodes:
+                    unresolved.append(file)
+                    continue
+                media_data_item = {'title': media_item['title'], 'year': media_item['year'], 'season_info': []}
+                add_episodes(media_data_item, file_episodes[0]['seasonNumber'], [episode['episodeNumber'] for episode in file_episodes], [file])
+                add_match(matches, media_item, media_data_item)
+    logger.debug(f"Resolved {len(nohl_files) - len(unresolved)} files by path, {len(unresolved)} files left to match by title")
+    return matches, unresolved
+
+def normalize_title(title):
+    title = unidecode(title)
+    return illegal_chars_regex.sub("", title)
+
+def title_key(title):
+    return re.sub(r'\W+', ' ', title)
+
+def match_titles(media_data, media, matches):
+    # Normalise every Arr title once and join the parsed files through dicts instead of comparing every pair
+    media_by_key = {}
+    media_by_title = {}
+    for media_item in media:
+        media_item_title_modified = normalize_title(re.sub(r' \(\d+\)', '', media_item['title']))
+        media_by_key.setdefault((title_key(media_item_title_modified), media_item['year']), []).append(media_item)
+        media_by_title.setdefault(media_item_title_modified, []).append(media_item)
     for media_data_item in media_data:
         media_data_item_title = media_data_item['title']
-        media_data_item_title_modified = unidecode(media_data_item['title'])
-        media_data_item_title_modified = illegal_chars_regex.sub("", media_data_item_title_modified)
         media_data_item_year = media_data_item['year']
-        for media_item in media:
-            quality_profile_id = None
-            quality_profile_name = None
-            media_item_title = media_item['title']
-            media_item_title_modified = unidecode(re.sub(r' \(\d+\)', '', (media_item['title'])))
-            media_item_title_modified = illegal_chars_regex.sub("", media_item_title_modified)
-            media_item_year = media_item['year']
-            media_item_id = media_item['id']
-            media_item_monitored = media_item['monitored']
-            quality_profile_id = media_item['qualityProfileId']
-            if media_data_item_title_modified == media_item_title_modified and abs(media_data_item_year - media_item_year) == 1:
-                logger.warning(f"Found match for {media_item_title} and {media_data_item_title} but years do not match. Media Year: {media_item_year}, File Year: {media_data_item_year}")
-            strings_match = lambda s1, s2: re.sub(r'\W+', ' ', s1) == re.sub(r'\W+', ' ', s2).replace(':', '-')
-            if strings_match(media_data_item_title_modified, media_item_title_modified) and media_data_item_year == media_item_year:
-                if media_item_title in exclude_series if exclude_series else False:
-                    logger.info(f"Skipping {media_item_title} because it is in the exclude list.")
-                    continue
-                if quality_profiles:
-                    quality_profile_name = next(key for key, value in quality_profiles.items() if value == quality_profile_id)
+        if media_data_item_title is None:
+            continue
+        media_data_item_title_modified = normalize_title(media_data_item_title)
+        for media_item in media_by_title.get(media_data_item_title_modified, []):
+            if abs(media_data_item_year - media_item['year']) == 1:
+                logger.warning(f"Found match for {media_item['title']} and {media_data_item_title} but years do not match. Media Year: {media_item['year']}, File Year: {media_data_item_year}")
+        for media_item in media_by_key.get((title_key(media_data_item_title_modified), media_data_item_year), []):
+            add_match(matches, media_item, media_data_item)
 
-                if (quality_profile_name in include_profiles if include_profiles else True) and (quality_profile_name not in exclude_profiles if exclude_profiles else True):
-                    if instance_type == 'Radarr':
-                        if media_item_monitored:
-                            try:
-                                file_ids = media_item['movieFile']['id']
-                                logger.debug(f"Found match: {media_item_title}, Media ID: {media_item_title}, File IDs: {file_ids}")
-                                results.append({
-                                    'title': media_item_title_modified, 
-                                    'media_id': media_item_id, 
-                                    'file_ids': file_ids
-                                })
-                            except:
-                                continue
-                        else:
-                            logger.info(f"Skipping {media_item_title} because it is not monitored.")
-                            continue
+def build_result(app, instance_type, media_data_item, media_item, quality_profiles, include_profiles, exclude_profiles, exclude_series, season_data_cache):
+    quality_profile_name = None
+    media_item_title = media_item['title']
+    media_item_id = media_item['id']
+    media_item_monitored = media_item['monitored']
+    quality_profile_id = media_item['qualityProfileId']
+    if media_item_title in exclude_series if exclude_series else False:
+        logger.info(f"Skipping {media_item_title} because it is in the exclude list.")
+        return None
+    if quality_profiles:
+        quality_profile_name = next((key for key, value in quality_profiles.items() if value == quality_profile_id), None)
 
-                    elif instance_type == 'Sonarr':
-                        monitored_seasons = []
-                        media_data_seasons = [season['season_number'] for season in media_data_item['season_info']]
-                        media_seasons = media_item['seasons']
-                        episode_info = []
+    if (quality_profile_name in include_profiles if include_profiles else True) and (quality_profile_name not in exclude_profiles if exclude_profiles else True):
+        if instance_type == 'Radarr':
+            if media_item_monitored:
+                try:
+                    file_ids = media_item['movieFile']['id']
+                    logger.debug(f"Found match: {media_item_title}, Media ID: {media_item_id}, File IDs: {file_ids}")
+                    return {
+                        'title': media_item_title, 
+                        'media_id': media_item_id, 
+                        'file_ids': file_ids,
+                        'files': media_data_item['files']
+                    }
+                except KeyError:
+                    return None
+            else:
+                logger.info(f"Skipping {media_item_title} because it is not monitored.")
+                return None
 
-                        if media_item_monitored:
-                            for s in media_seasons:
-                                season_monitored = s['monitored']
-                                if season_monitored:
-                                    monitored_seasons.append(s['seasonNumber'])
-                                else: 
-                                    logger.debug(f"Skipping {media_item_title} because season {s['seasonNumber']} is not monitored.")
-                            common_seasons = list(set(monitored_seasons) & set(media_data_seasons))
-                            season_info = []
+        elif instance_type == 'Sonarr':
+            monitored_seasons = []
+            media_data_seasons = [season['season_number'] for season in media_data_item['season_info']]
+            media_seasons = media_item['seasons']
 
-                            for item in media_seasons:
-                                if item['seasonNumber'] in common_seasons:
-                                    stats = item['statistics']
-                                    episodeCount = stats['episodeFileCount']
-                                    totalEpisodeCount = stats['totalEpisodeCount']
-                                    season_pack = episodeCount == totalEpisodeCount
-                                    season_info.append({
-                                        'season_number': item['seasonNumber'], 
-                                        'season_pack': season_pack, 
-                                        'episode_info': []
-                                    })
+            if media_item_monitored:
+                for s in media_seasons:
+                    season_monitored = s['monitored']
+                    if season_monitored:
+                        monitored_seasons.append(s['seasonNumber'])
+                    else: 
+                        logger.debug(f"Skipping {media_item_title} because season {s['seasonNumber']} is not monitored.")
+                common_seasons = list(set(monitored_seasons) & set(media_data_seasons))
+                season_info = []
 
-                            season_data = app.get_season_data(media_item_id)
+                for item in media_seasons:
+                    if item['seasonNumber'] in common_seasons:
+                        stats = item['statistics']
+                        episodeCount = stats['episodeFileCount']
+                        totalEpisodeCount = stats['totalEpisodeCount']
+                        season_pack = episodeCount == totalEpisodeCount
+                        season_info.append({
+                            'season_number': item['seasonNumber'], 
+                            'season_pack': season_pack, 
+                            'episode_info': [],
+                            'files': [file for season in media_data_item['season_info'] if season['season_number'] == item['seasonNumber'] for file in season['files']]
+                        })
 
-                            for item in season_info:
-                                season_number = item['season_number']
-                                season_pack = item['season_pack']
-                                episode_info = item['episode_info']
-                                episode_file_id = []
-                                episode_ids = []
-                                episode_numbers = []
+                if media_item_id not in season_data_cache:
+                    season_data_cache[media_item_id] = app.get_season_data(media_item_id) or []
+                season_data = season_data_cache[media_item_id]
 
-                                for season_data_item in season_data or []:
-                                    if not season_data_item['monitored']:
-                                        continue
-                                    if season_data_item['seasonNumber'] == season_number:
-                                        media_data_episodes = [episode for season in media_data_item['season_info'] if season['season_number'] == season_number for episode in season['episodes']]
-                                        if season_pack:
-                                            if season_data_item['episodeFileId'] not in episode_file_id:
-                                                episode_file_id.append(season_data_item['episodeFileId'])
-                                        elif not season_pack and season_data_item['episodeNumber'] in media_data_episodes:
-                                            episode_file_id.append(season_data_item['episodeFileId'])
-                                            episode_ids.append(season_data_item['id'])
-                                            episode_numbers.append(season_data_item['episodeNumber'])
+                for item in season_info:
+                    season_number = item['season_number']
+                    season_pack = item['season_pack']
+                    episode_info = item['episode_info']
+                    episode_file_id = []
+                    episode_ids = []
+                    episode_numbers = []
+                    media_data_episodes = [episode for season in media_data_item['season_info'] if season['season_number'] == season_number for episode in season['episodes']]
 
-                                episode_info.append({
-                                    'episode_file_id': episode_file_id, 
-                                    'episode_ids': episode_ids, 
-                                    'episode_numbers': episode_numbers
-                                })
-                            results.append({
-                                'title': media_item_title,
-                                'media_id': media_item_id, 
-                                'seasons': season_info
-                            })
-                        else:
-                            logger.info(f"Skipping {media_item_title} because it is not monitored.")
+                    for season_data_item in season_data:
+                        if not season_data_item['monitored']:
                             continue
-                else:
-                    if quality_profile_name:
-                        logger.info(f"Skipping {media_item_title} because it does not meet quality profile requirements. Quality Profile: {quality_profile_name}")
-                    else:
-                        logger.info(f"Skipping {media_item_title} because it does not have a quality profile.")
-                    continue
-                
+                        if season_data_item['seasonNumber'] == season_number:
+                            if season_pack:
+                                if season_data_item['episodeFileId'] not in episode_file_id:
+                                    episode_file_id.append(season_data_item['episodeFileId'])
+                            elif not season_pack and season_data_item['episodeNumber'] in media_data_episodes:
+                                if season_data_item['episodeFileId'] not in episode_file_id:
+                                    episode_file_id.append(season_data_item['episodeFileId'])
+                                episode_ids.append(season_data_item['id'])
+                                episode_numbers.append(season_data_item['episodeNumber'])
+
+                    episode_info.append({
+                        'episode_file_id': episode_file_id, 
+                        'episode_ids': episode_ids, 
+                        'episode_numbers': episode_numbers
+                    })
+                return {
+                    'title': media_item_title,
+                    'media_id': media_item_id, 
+                    'seasons': season_info
+                }
+            else:
+                logger.info(f"Skipping {media_item_title} because it is not monitored.")
+                return None
+    else:
+        if quality_profile_name:
+            logger.info(f"Skipping {media_item_title} because it does not meet quality profile requirements. Quality Profile: {quality_profile_name}")
+        else:
+            logger.info(f"Skipping {media_item_title} because it does not have a quality profile.")
+        return None
+
+def process_instances(instance_name, instance_type, url, api, nohl_files, include_profiles, exclude_profiles, dry_run, exclude_series):
+    nohl_files.sort()
+    app = StARR(url, api, logger)
+    media = app.get_media()
+    season_data = {}
+    matches, unresolved = resolve_paths(app, instance_type, media, nohl_files, season_data)
+    if unresolved:
+        media_data = parse_files(instance_type, unresolved)
+        logger.debug(f"Media Data: {json.dumps(media_data, indent=4)}")
+        match_titles(media_data, media, matches)
+    if instance_type == 'Sonarr':
+        # The series matched by title haven't been looked up yet, they are fetched together instead of one by one
+        missing = [media_id for media_id in matches if media_id not in season_data]
+        season_data.update(app.iter_season_data(missing, config.workers))
+    results = []
+    quality_profiles = app.get_quality_profile_names()
+    for media_data_item, media_item in matches.values():
+        result = build_result(app, instance_type, media_data_item, media_item, quality_profiles, include_profiles, exclude_profiles, exclude_series, season_data)
+        if result:
+            results.append(result)
     logger.debug(f"Results: {json.dumps(results, indent=4)}")
-    final_step(app, results, instance_type, dry_run)
+    queue_results(instance_name, instance_type, results, dry_run)
 
-def final_step(app, results, instance_type, dry_run):
-    searches = config.maximum_searches
-    logger.debug(f"Searches: {searches}")
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    tmp_dir = os.path.join(script_dir, 'tmp')
-    tmp_file_path = f'{tmp_dir}/search_count.txt'
-    if not os.path.exists(tmp_dir):
-        os.makedirs(tmp_dir)
-    if not os.path.exists(tmp_file_path):
-        try:
-            with open(tmp_file_path, 'w') as f:
-                f.write('0\n0')
-        except OSError as e:
-            logger.error(f"Error creating search count file: {e}")
-            sys.exit(1)
-    try:
-        with open(tmp_file_path, 'r') as f:
-            search_count, last_search_time = map(int, f.read().split('\n'))
-    except ValueError:
-        search_count, last_search_time = 0, 0
-    current_time = int(time.time())
-    if current_time - last_search_time >= 3600:
-        search_count = 0
-        last_search_time = current_time
+def make_jobs(instance_name, instance_type, results):
+    # Every job costs one search, so a series is split into a job per season
+    season_packs_first = config.queue_priority == 'season_packs'
+    jobs = []
     for result in results:
-        if search_count >= searches:
-            logger.warning('Maximum number of searches reached, cannot perform search')
-            break
         media_id = result['media_id']
         title = result['title']
-        if instance_type == 'Sonarr':
-            seasons = result['seasons']
-            for season in seasons:
-                season_number = season['season_number']
-                season_pack = season['season_pack']
-                episode_info = season['episode_info']
-                if season_pack:
-                    episode_file_id = episode_info[0]['episode_file_id']
-                    logger.debug(f"Processing {instance_type} - Deleting episode file for {title} Season {season_number}, Season Pack: {season_pack}")
-                    if not dry_run:
-                        app.delete_episode_files(episode_file_id)
-                        app.refresh_media(media_id)
-                        app.search_season(media_id, season_number)
-                        logger.info(f"Deleted Season {season_number} for {title}, and a search request was sent to Sonarr for Season {season_number}")
-                        search_count += 1
-                    else:
-                        logger.info(f"Would have deleted Season {season_number} for {title}, and the a search request would have been sent to Sonarr for Season {season_number}")
-                elif not season_pack:
-                    episode_file_id = episode_info[0]['episode_file_id']
-                    episode_ids = episode_info[0]['episode_ids']
-                    episode_numbers = episode_info[0]['episode_numbers']
-                    logger.debug(f"Processing {instance_type} - Deleting episode file for {title} Season {season_number}, Season Pack: {season_pack}")
-                    if not dry_run:
-                        app.delete_episode_files(episode_file_id)
-                        app.refresh_media(media_id)
-                        app.search_episodes(episode_ids)
-                        search_count += 1  
-                        logger.info(f"Deleted episode file for {title} Season {season_number} episodes {episode_numbers}, search request sent to Sonarr")
-                    else:
-                        logger.info(f"Would have deleted episode files for {title} Season {season_number} episodes {episode_numbers}, and the individual episodes would have been searched for a replacement")
-                logger.debug(f"Search counter: {search_count}")
-        elif instance_type == 'Radarr':
-            file_ids = result['file_ids']
-            logger.debug(f"Processing {instance_type} - Deleting movie file for {title}")
-            if not dry_run:
-                app.delete_movie_file(file_ids)
-                app.refresh_media(media_id)
-                app.search_media(media_id)
-                logger.info(f"Deleted movie file for {title}, and the movie was searched for a replacement")
-                search_count += 1
-            else:
-                logger.info(f"Would have deleted movie file for {title}, and the movie would have been searched for a replacement")   
-    logger.debug(f"Search Total: {search_count}")
-    try:
-        with open(tmp_file_path, 'w') as f:
-            f.write(f'{search_count}\n{last_search_time}')
-    except Exception as e:
-        logger.error(f"Error writing to file: {e}")
+        if instance_type == 'Radarr':
+            jobs.append((f"{instance_name}|movie|{media_id}", 1 if season_packs_first else 0, {
+                'type': 'movie',
+                'title': title,
+                'media_id': media_id,
+                'file_ids': result['file_ids'],
+                'files': result['files']
+            }))
+        elif instance_type == 'Sonarr':
+            for season in result['seasons']:
+                job_type = 'season' if season['season_pack'] else 'episodes'
+                episode_info = season['episode_info'][0]
+                jobs.append((f"{instance_name}|{job_type}|{media_id}|{season['season_number']}", 0 if season['season_pack'] or not season_packs_first else 1, {
+                    'type': job_type,
+                    'title': title,
+                    'media_id': media_id,
+                    'season_number': season['season_number'],
+                    'episode_file_id': episode_info['episode_file_id'],
+                    'episode_ids': episode_info['episode_ids'],
+                    'episode_numbers': episode_info['episode_numbers'],
+                    'files': season['files']
+                }))
+    return jobs
+
+def queue_results(instance_name, instance_type, results, dry_run):
+    jobs = make_jobs(instance_name, instance_type, results)
+    if dry_run:
+        for _, _, job in sorted(jobs, key=lambda job: job[1]):
+            run_job(None, instance_type, job, dry_run)
+        return
+    if not config.maximum_searches:
+        return
+    added = 0
+    for key, priority, job in jobs:
+        if search_queue.push(key, instance_name, priority, job):
+            added += 1
+    logger.info(f"Queued {added} new searches for {instance_name}, {len(jobs) - added} were already queued")
+
+def still_needed(job):
+    # The file may have been hardlinked again (e.g. relinked or re-downloaded) since the job was queued
+    for file in job['files']:
+        try:
+            if os.stat(file).st_nlink == 1:
+                return True
+        except OSError:
+            continue
+    return not job['files']
+
+def refresh_job(app, job):
+    # The files may have been upgraded or removed in the Arr since the job was queued, deleting by the old ids would fail.
+    # Jobs are matched by the ids resolved when they were queued, the Arr can see the files under a different path
+    if job['type'] == 'movie':
+        if job['file_ids'] not in {movie_file['id'] for movie_file in app.get_movie_files([job['media_id']]) or []}:
+            return None
+        return job
+    if job['type'] == 'season':
+        episode_file_ids = []
+        for episode in app.get_season_data(job['media_id']) or []:
+            if episode['monitored'] and episode['seasonNumber'] == job['season_number'] and episode.get('episodeFileId') and episode['episodeFileId'] not in episode_file_ids:
+                episode_file_ids.append(episode['episodeFileId'])
+    else:
+        current_ids = {episode_file['id'] for episode_file in app.get_episode_files(job['media_id']) or []}
+        episode_file_ids = [episode_file_id for episode_file_id in job['episode_file_id'] if episode_file_id in current_ids]
+    if not episode_file_ids:
+        return None
+    return dict(job, episode_file_id=episode_file_ids)
+
+def run_job(app, instance_type, job, dry_run):
+    media_id = job['media_id']
+    title = job['title']
+    if job['type'] == 'season':
+        season_number = job['season_number']
+        logger.debug(f"Processing {instance_type} - Deleting episode file for {title} Season {season_number}, Season Pack: True")
+        if not dry_run:
+            app.delete_episode_files(job['episode_file_id'])
+            app.refresh_media(media_id)
+            app.search_season(media_id, season_number)
+            logger.info(f"Deleted Season {season_number} for {title}, and a search request was sent to Sonarr for Season {season_number}")
+        else:
+            logger.info(f"Would have deleted Season {season_number} for {title}, and the a search request would have been sent to Sonarr for Season {season_number}")
+    elif job['type'] == 'episodes':
+        season_number = job['season_number']
+        episode_numbers = job['episode_numbers']
+        logger.debug(f"Processing {instance_type} - Deleting episode file for {title} Season {season_number}, Season Pack: False")
+        if not dry_run:
+            app.delete_episode_files(job['episode_file_id'])
+            app.refresh_media(media_id)
+            app.search_episodes(job['episode_ids'])
+            logger.info(f"Deleted episode file for {title} Season {season_number} episodes {episode_numbers}, search request sent to Sonarr")
+        else:
+            logger.info(f"Would have deleted episode files for {title} Season {season_number} episodes {episode_numbers}, and the individual episodes would have been searched for a replacement")
+    elif job['type'] == 'movie':
+        logger.debug(f"Processing {instance_type} - Deleting movie file for {title}")
+        if not dry_run:
+            app.delete_movie_file(job['file_ids'])
+            app.refresh_media(media_id)
+            app.search_media(media_id)
+            logger.info(f"Deleted movie file for {title}, and the movie was searched for a replacement")
+        else:
+            logger.info(f"Would have deleted movie file for {title}, and the movie would have been searched for a replacement")
+
+def drain_queue():
+    instances = {}
+    for instance_type, instance_data in [('Radarr', config.radarr_data), ('Sonarr', config.sonarr_data)]:
+        for instance in instance_data:
+            instances[instance['name']] = (instance_type, instance['url'], instance['api'])
+    apps = {}
+    unavailable = set()
+    searches = 0
+    exhausted = False
+    for key, instance_name, job in search_queue.jobs():
+        if instance_name not in instances:
+            logger.warning(f"{instance_name} is no longer configured, dropping the queued search for {job['title']}")
+            search_queue.remove(key)
+            continue
+        if instance_name in unavailable:
+            continue
+        if not still_needed(job):
+            logger.info(f"{job['title']} is hardlinked again, dropping the queued search")
+            search_queue.remove(key)
+            continue
+        instance_type, url, api = instances[instance_name]
+        if instance_name not in apps:
+            try:
+                apps[instance_name] = StARR(url, api, logger)
+            except (SystemExit, requests.exceptions.RequestException):
+                # StARR exits when an instance can't be reached, its jobs are kept for the next run
+                logger.error(f"Unable to connect to {instance_name}, skipping its queued searches")
+                unavailable.add(instance_name)
+                continue
+        try:
+            current_job = refresh_job(apps[instance_name], job)
+            if current_job is None:
+                logger.info(f"The files of {job['title']} are no longer in {instance_name}, dropping the queued search")
+                search_queue.remove(key)
+                continue
+            if not search_budget.take():
+                logger.warning(f"Maximum number of searches reached, {len(search_queue)} searches left in the queue")
+                exhausted = True
+                break
+            run_job(apps[instance_name], instance_type, current_job, False)
+        except (SystemExit, requests.exceptions.RequestException):
+            # A failed job would otherwise stay at the front of the queue and block every later run
+            logger.error(f"Queued search for {job['title']} in {instance_name} failed, dropping it")
+            search_queue.remove(key)
+            continue
+        search_queue.remove(key)
+        searches += 1
+    logger.debug(f"Search Total: {searches}")
+    return exhausted
 
 def main():
+    parser = argparse.ArgumentParser(description="Find files that are not hardlinked and search for a replacement in Radarr/Sonarr")
+    parser.add_argument('--time-budget', type=float, default=None, metavar='MINUTES', help="Stop scanning after this many minutes and carry on from there on the next run")
+    args = parser.parse_args()
+    deadline = time.time() + args.time_budget * 60 if args.time_budget else None
     exclude_series = None
     instances_to_run = []
     include_profiles = None
@@ -365,47 +589,37 @@ def main():
             else:
                 logger.warning(f"No paths set for {item['name']}")
                 continue
-    nohl_files = find_no_hl_files(paths)
+    if not dry_run and search > 0 and len(search_queue):
+        logger.info(f"Working through {len(search_queue)} queued searches before scanning")
+        # Jobs of instances that can't be reached don't hold up the scan, only running out of searches does
+        if drain_queue():
+            logger.info(f"{len(search_queue)} searches are still queued, skipping the scan until the queue is empty")
+            return
+    nohl_files = find_no_hl_files(paths, deadline)
+    if nohl_files and config.qbit:
+        nohl_files = remove_seeding_files(nohl_files)
+    relink_settings = relink.load_settings(config.relink)
+    if nohl_files and relink_settings['enabled']:
+        # Files that are still sitting in the download directories only need to be hardlinked again, not searched for
+        relinker = relink.Relinker(relink_settings['download_paths'], logger, config.extensions, config.workers, config.use_cache)
+        nohl_files = relinker.relink(nohl_files, dry_run)
     if nohl_files:
-        instances_to_run = []
-        try:
-            if config.script_data['radarr']:
-                for radarr_config in config.script_data['radarr']:
-                    if radarr_config['paths']:
-                        for radarr_path in ([radarr_config['paths']] if isinstance(radarr_config['paths'], str) else radarr_config['paths']):
-                            if any(nohl_path.startswith(radarr_path) for nohl_path in nohl_files):
-                                instance_found = False
-                                for instance in instances_to_run:
-                                    if instance['instance_name'] == radarr_config['name']:
-                                        instance['files_to_process'].extend([nohl_file for nohl_file in nohl_files if nohl_file.startswith(radarr_path)])
-                                        instance_found = True
-                                        break
-                                if not instance_found:
-                                    instances_to_run.append({
-                                        'instance_name': radarr_config['name'], 
-                                        'files_to_process':[nohl_file for nohl_file in nohl_files if nohl_file.startswith(radarr_path)]
-                                    })
-        except KeyError:
-            logger.warning("No Radarr instances found in script_data")
-        try:
-            if config.script_data['sonarr']:
-                for sonarr_config in config.script_data['sonarr']:
-                    if sonarr_config['paths']:
-                        for sonarr_path in ([sonarr_config['paths']] if isinstance(sonarr_config['paths'], str) else sonarr_config['paths']):
-                            if any(nohl_path.startswith(sonarr_path) for nohl_path in nohl_files):
-                                instance_found = False
-                                for instance in instances_to_run:
-                                    if instance['instance_name'] == sonarr_config['name']:
-                                        instance['files_to_process'].extend([nohl_file for nohl_file in nohl_files if nohl_file.startswith(sonarr_path)])
-                                        instance_found = True
-                                        break
-                                if not instance_found:
-                                    instances_to_run.append({
-                                        'instance_name': sonarr_config['name'], 
-                                        'files_to_process':[nohl_file for nohl_file in nohl_files if nohl_file.startswith(sonarr_path)]
-                                    })
-        except KeyError:
-            logger.warning("No Sonarr instances found in script_data")
+        # Route every file to the instances whose paths it is under with a single walk down the trie
+        trie = PathTrie()
+        for instance_type in ['radarr', 'sonarr']:
+            if not config.script_data.get(instance_type):
+                logger.warning(f"No {instance_type.capitalize()} instances found in script_data")
+                continue
+            for instance_config in config.script_data[instance_type]:
+                instance_paths = instance_config.get('paths') or []
+                for instance_path in ([instance_paths] if isinstance(instance_paths, str) else instance_paths):
+                    if instance_path:
+                        trie.add(instance_path, instance_config['name'])
+        files_by_instance = {}
+        for nohl_file in nohl_files:
+            for instance_name in trie.find(nohl_file):
+                files_by_instance.setdefault(instance_name, []).append(nohl_file)
+        instances_to_run = [{'instance_name': instance_name, 'files_to_process': files} for instance_name, files in files_by_instance.items()]
         logger.debug(f"Instances to run: {json.dumps(instances_to_run, indent=4)}")
             
     instance_data = {
@@ -452,7 +666,9 @@ def main():
                                     sys.exit()
                                 nohl_files = _instance['files_to_process']
                                 logger.debug(f"Processing {len(nohl_files)} files")
-                        process_instances(instance_type, url, api, nohl_files, include_profiles, exclude_profiles, dry_run, exclude_series)
+                        process_instances(instance_name, instance_type, url, api, nohl_files, include_profiles, exclude_profiles, dry_run, exclude_series)
+    if not dry_run and search > 0:
+        drain_queue()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
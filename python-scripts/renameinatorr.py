@@ -10,16 +10,20 @@
 # Author: Drazzilb
 # Description: This script will rename all series in Sonarr/Radarr to match the naming scheme of the
 #              Naming Convention within Radarr/Sonarr. It will also add a tag to the series so that it can be easily
-#              identified as having been renamed.
+#              identified as having been renamed.  Instances are processed at the same time with their output
+#              kept together.
 # Usage: python3 /path/to/renameinatorr.py
 # Requirements: requests, pyyaml
-# Version: 2.0.6
+# Version: 2.1.0
 # License: MIT License
 # ===================================================================================================
 
 import json
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
 from modules.config import Config
-from modules.logger import setup_logger
+from modules.logger import setup_logger, buffer_logs
 from modules.arrpy import StARR
 
 config = Config(script_name="renameinatorr")
@@ -103,6 +107,8 @@ def process_instance(instance_type, instance_name, url, api, tag_name, count, dr
         dry_run (bool): Whether or not to perform a dry run.
         reset (bool): Whether or not to reset the tag.
         unattended (bool): Whether or not to run unattended.
+    Returns:
+        int: The number of items renamed.
     """
     file_id = None
     media_type = None
@@ -140,7 +146,7 @@ def process_instance(instance_type, instance_name, url, api, tag_name, count, dr
         logger.info(f'All of {instance_name} has been tagged with {tag_name}')
         logger.info("If you would like to remove the tag and re-run the script, please set reset to True or set unattended to True.")
         logger.info(f"Skipping {instance_name}...")
-        return
+        return 0
     if not all_tagged:
         untagged_media = [
             m for m in media if arr_tag_id not in m['tags']]
@@ -175,6 +181,36 @@ def process_instance(instance_type, instance_name, url, api, tag_name, count, dr
         tagged_percent = ((tagged_count + new_tag) / total_count) * 100
         untagged_percent = (untagged_count / total_count) * 100
         print_format(items, instance_type.lower(), dry_run, total_count, tagged_percent, untagged_percent, media_type, tagged_count, untagged_count)
+        return len(media_ids)
+    return 0
+
+def run_instance(instance_name, url, api, args):
+    """
+    Process an instance with its output held back until it is done.
+    Parameters:
+        instance_name (str): The name of the instance.
+        url (str): The URL of the instance.
+        api (str): The API key of the instance.
+        args (tuple): The arguments for process_instance.
+    Returns:
+        list: The name of the instance, the number of items renamed (None if it failed) and the seconds it took.
+    """
+    started = time.time()
+    with buffer_logs(logger):
+        logger.info('*' * 40)
+        logger.info(f'* {instance_name:^36} *')
+        logger.info('*' * 40)
+        logger.debug(f'{" Settings ":*^40}')
+        logger.debug(f"Instance Name: {instance_name}")
+        logger.debug(f"url: {url}")
+        logger.debug(f"api: {'*' * (len(api) - 5)}{api[-5:]}")
+        try:
+            renamed = process_instance(*args)
+        except (SystemExit, requests.exceptions.RequestException):
+            # StARR exits or the request raises when an instance can't be reached, the other instances carry on
+            logger.error(f"Processing {instance_name} failed")
+            renamed = None
+    return [instance_name, renamed, time.time() - started]
 
 def main():
     """
@@ -203,6 +239,7 @@ def main():
         'Radarr': config.radarr_data,
         'Sonarr': config.sonarr_data
     }
+    tasks = []
 
     for instance_type, instances in instance_data.items():
         for instance in instances:
@@ -227,14 +264,19 @@ def main():
                     reset = data['reset']
                     unattended = data['unattended']
             if script_name and instance_name == script_name:
-                logger.info('*' * 40)
-                logger.info(f'* {instance_name:^36} *')
-                logger.info('*' * 40)
-                logger.debug(f'{" Settings ":*^40}')
-                logger.debug(f"Instance Name: {instance_name}")
-                logger.debug(f"url: {url}")
-                logger.debug(f"api: {'*' * (len(api) - 5)}{api[-5:]}")
-                process_instance(instance_type, instance_name, url, api, tag_name, count, config.dry_run, reset, unattended)
+                args = (instance_type, instance_name, url, api, tag_name, count, config.dry_run, reset, unattended)
+                tasks.append((instance_name, url, api, args))
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, config.instance_workers)) as executor:
+        results = list(executor.map(lambda task: run_instance(*task), tasks))
+    logger.info(f'{" Summary ":*^40}')
+    for instance_name, renamed, seconds in results:
+        if renamed is None:
+            logger.info(f"{instance_name}: failed after {seconds:.1f}s")
+        else:
+            logger.info(f"{instance_name}: {renamed} {'would be renamed' if config.dry_run else 'renamed'} in {seconds:.1f}s")
+    total = sum(renamed for _, renamed, _ in results if renamed)
+    logger.info(f"Total: {total} {'would be renamed' if config.dry_run else 'renamed'} across {len(results)} instances in {time.time() - started:.1f}s")
 
 if __name__ == "__main__":
     """
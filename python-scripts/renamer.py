@@ -11,8 +11,8 @@
 # Description: This script will check for unmatched assets in your Plex library.
 #              It will output the results to a file in the logs folder.
 # Usage: python3 renamer.py 
-# Requirements: requests, tqdm, fuzzywuzzy, pyyaml
-# Version: 5.3.3
+# Requirements: requests, tqdm, fuzzywuzzy, pyyaml, Pillow (optional)
+# Version: 5.6.0
 # License: MIT License
 # ===================================================================================================
 
@@ -21,6 +21,9 @@ from modules.logger import setup_logger
 from plexapi.server import PlexServer
 from modules.config import Config
 from modules.arrpy import StARR
+from modules.optimizer import load_settings, load_cache, save_cache, find_optimized, optimize_posters
+from modules import phash
+from modules.walker import Walker, list_dir
 from unidecode import unidecode
 from fuzzywuzzy import process
 from fuzzywuzzy import fuzz
@@ -277,10 +280,23 @@ def match_media(media, source_file_list, type):
     logger.debug(f"Not matched media: {json.dumps(not_matched, ensure_ascii=False, indent=4)}")
     return matched_media
 
-def rename_file(matched_media, destination_dir, dry_run, action_type, print_only_renames):
+def rename_file(matched_media, destination_dir, dry_run, action_type, print_only_renames, poster_hashes):
     messages = []
+    placed_files = []
     asset_folders = config.asset_folders
+    optimizer_settings = load_settings(config.optimize_posters)
+    optimizer_cache = None
+    if optimizer_settings['enabled'] and action_type in ['copy', 'hardlink']:
+        optimizer_cache = load_cache(optimizer_settings)
+    duplicate_settings = phash.load_settings(config.duplicate_posters)
     destination_files = os.listdir(destination_dir)
+    destination_hashes = {}
+    if duplicate_settings['enabled'] and duplicate_settings['skip_existing'] and poster_hashes and action_type in ['copy', 'hardlink']:
+        if asset_folders:
+            existing_files = [entry.path for entry in Walker(logger, workers=config.workers).walk([destination_dir])]
+        else:
+            existing_files = [os.path.join(destination_dir, file) for file in destination_files]
+        destination_hashes = phash.hash_files(existing_files, logger, duplicate_settings['workers'])
     for media in tqdm(matched_media['matched_media'], desc="Renaming files", total=len(matched_media['matched_media']), disable=None):
         files = media['files']
         folder = media['folder']
@@ -331,6 +347,11 @@ def rename_file(matched_media, destination_dir, dry_run, action_type, print_only
                 destination_file_path = os.path.join(destination_dir, folder, new_file_name)
             else:
                 destination_file_path = os.path.join(destination_dir, new_file_name)
+            if optimizer_cache is not None:
+                optimized_path = find_optimized(source_file_path, destination_file_path, optimizer_cache)
+                if optimized_path:
+                    logger.debug(f"Skipping {old_file_name}, {optimized_path} is its optimized copy")
+                    continue
             if config.source_overrides:
                 if path in config.source_overrides:
                     if asset_folders:
@@ -352,11 +373,27 @@ def rename_file(matched_media, destination_dir, dry_run, action_type, print_only
                                 else:
                                     messages.append(f"Removed {i} from {destination_dir}")
                                     os.remove(os.path.join(destination_dir, i))
+            output = None
+            if source_file_path in poster_hashes and destination_file_path in destination_hashes and not os.path.samefile(source_file_path, destination_file_path):
+                distance = phash.hamming(poster_hashes[source_file_path], destination_hashes[destination_file_path])
+                if distance <= duplicate_settings['threshold']:
+                    logger.debug(f"Skipping {old_file_name}, {destination_file_path} is already a duplicate of it (distance: {distance})")
+                    continue
             if new_file_name != old_file_name:
-                messages.extend(process_file(old_file_name, new_file_name, action_type, dry_run, destination_file_path, source_file_path, '->'))
+                output = process_file(old_file_name, new_file_name, action_type, dry_run, destination_file_path, source_file_path, '->')
             else:
                 if not print_only_renames:
-                    messages.extend(process_file(old_file_name, new_file_name, action_type, dry_run, destination_file_path, source_file_path, '-->>'))
+                    output = process_file(old_file_name, new_file_name, action_type, dry_run, destination_file_path, source_file_path, '-->>')
+            if output:
+                messages.extend(output)
+                placed_files.append(destination_file_path)
+    if optimizer_cache is not None:
+        # The digests of the source posters are kept so later runs don't read every poster again
+        if not dry_run:
+            messages.extend(optimize_posters(placed_files, optimizer_settings, logger, optimizer_cache))
+        save_cache(optimizer_cache)
+    elif optimizer_settings['enabled'] and not dry_run:
+        messages.extend(optimize_posters(placed_files, optimizer_settings, logger))
     return messages
 
 def process_file(old_file_name, new_file_name, action_type, dry_run, destination_file_path, source_file_path, arrow):
@@ -409,8 +446,11 @@ def process_file(old_file_name, new_file_name, action_type, dry_run, destination
                     if os.path.samefile(source_file_path, destination_file_path):
                         pass
                     else:
-                        os.replace(destination_file_path, source_file_path)
-                        os.link(source_file_path, destination_file_path)
+                        # Replace the destination through a temporary link, the source is never touched
+                        if os.path.lexists(f'{destination_file_path}.tmp'):
+                            os.remove(f'{destination_file_path}.tmp')
+                        os.link(source_file_path, f'{destination_file_path}.tmp')
+                        os.replace(f'{destination_file_path}.tmp', destination_file_path)
                         output.append(f"Action Type: {action_type.capitalize()}: {old_file_name} {arrow} {new_file_name}")
                 else:
                     logger.error(f"Unable to hardlink file: {e}")
@@ -453,7 +493,8 @@ def find_or_create_show(show_list, title, year, files, path):
 def get_files(path):
     files = []
     try:
-        files = os.listdir(path)
+        folders, files = list_dir(path)
+        files = folders + files
     except FileNotFoundError:
         logger.error(f"Path not found: {path}")
     return files
@@ -529,7 +570,24 @@ def handle_override_files(asset_files, override_files, asset_types):
                 asset_files[type].append(override_asset)
     return asset_files
 
-def process_instance(instance_type, instance_name, url, api, final_output, asset_files):
+def find_duplicate_posters(asset_files):
+    duplicate_settings = phash.load_settings(config.duplicate_posters)
+    if not duplicate_settings['enabled']:
+        return {}
+    files = [file for asset_type in asset_files for asset in asset_files[asset_type] for file in asset['files']]
+    poster_hashes = phash.hash_files(files, logger, duplicate_settings['workers'])
+    clusters = phash.find_duplicates(poster_hashes, duplicate_settings['threshold'])
+    if clusters:
+        logger.info(f"Found {len(clusters)} groups of duplicate posters:")
+        for cluster in clusters:
+            logger.info(f"\t{os.path.basename(cluster[0])}")
+            for file in cluster[1:]:
+                logger.info(f"\t\t{file}")
+    else:
+        logger.info("No duplicate posters found")
+    return poster_hashes
+
+def process_instance(instance_type, instance_name, url, api, final_output, asset_files, poster_hashes):
     collections = []
     media = []
     collection_names = []
@@ -560,7 +618,7 @@ def process_instance(instance_type, instance_name, url, api, final_output, asset
     elif instance_type == "Sonarr":
         matched_media = match_media(media, asset_files, "series")
     if matched_media:
-        message = rename_file(matched_media, config.destination_dir, config.dry_run, config.action_type, config.print_only_renames)
+        message = rename_file(matched_media, config.destination_dir, config.dry_run, config.action_type, config.print_only_renames, poster_hashes)
         final_output.extend(message)
     else:
         message = f"No matches found for {instance_name}"
@@ -590,6 +648,8 @@ def main():
     logger.debug(f"collection_threshold: {config.collection_threshold}")
     logger.debug(f"action_type: {config.action_type}")
     logger.debug(f"print_only_renames: {config.print_only_renames}")
+    logger.debug(f"optimize_posters: {config.optimize_posters}")
+    logger.debug(f"duplicate_posters: {config.duplicate_posters}")
     logger.debug(f'*' * 40)
     logger.debug('')
     if config.dry_run:
@@ -600,6 +660,7 @@ def main():
         logger.info('*' * 40)
         logger.info('')
     asset_files = get_assets_files(config.source_dir, config.source_overrides)
+    poster_hashes = find_duplicate_posters(asset_files)
     instance_data = {
         'Plex': config.plex_data,
         'Radarr': config.radarr_data,
@@ -631,7 +692,7 @@ def main():
                 logger.debug(f"Instance Name: {instance_name}")
                 logger.debug(f"URL: {url}")
                 logger.debug(f"API Key: {'<redacted>' if api else 'None'}")
-                final_output = process_instance(instance_type, instance_name, url, api, final_output, asset_files)
+                final_output = process_instance(instance_type, instance_name, url, api, final_output, asset_files, poster_hashes)
                 print_output(final_output)
 if __name__ == "__main__":
     main()
\ No newline at end of file
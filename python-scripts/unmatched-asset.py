@@ -12,51 +12,87 @@
 #                are any folders that do not have a matching asset. It will also check your collections
 #                against your assets folder to see if there are any collections that do not have a
 #                matching asset. It will output the results to a file in the logs folder.
-#  Usage: python3 unmatched=asset.py
+#  Usage: python3 unmatched=asset.py [--diff]
 #  Note: There is a limitation to how this script works with regards to it matching series assets the
 #         main series poster requires seasonal posters to be present. If you have a series that does
 #         not have a seasonal poster then it will not match the series poster.
-#  Requirements: requests
-#  Version: 4.1.8
+#  Requirements: requests, rapidfuzz (optional)
+#  Version: 4.8.0
 #  License: MIT License
 # ===========================================================================================================
 
 import os
 import re
-from pathlib import Path
+import argparse
 from plexapi.server import PlexServer
 from plexapi.exceptions import BadRequest
 from modules.logger import setup_logger
 from modules.config import Config
+from modules.arrpy import StARR
+from modules.dircache import DirCache
+from modules.walker import list_dir
+from modules.report import ReportWriter, load_state, save_state
 import sys
 from unidecode import unidecode
 from tqdm import tqdm
 import json
 import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:
+    process = None
 
 config = Config(script_name="unmatched-assets")
 logger = setup_logger(config.log_level, "unmatched-assets")
 logging.getLogger("requests").setLevel(logging.WARNING)
 logging.getLogger('urllib3').setLevel(logging.WARNING)
+# Listings and title folder classifications are cached separately, a media path can also be a title folder
+dir_cache = DirCache("unmatched-assets_dircache", logger, config.use_cache, version=2)
+title_cache = DirCache("unmatched-assets_titlecache", logger, config.use_cache)
 
 illegal_chars_regex = re.compile(r'[<>:"/\\|?*\x00-\x1f]+')
 year_regex = re.compile(r"\((19|20)\d{2}\).*")
+normalize_regex = re.compile(r'[^A-Za-z0-9]+')
+token_regex = re.compile(r'[a-z0-9]+')
+suggestion_year_regex = re.compile(r"\((\d{4})\)")
 
 season_name_info = [
     "_Season",
     "Season"
 ]
 
+stop_words = {"the", "a", "an", "and", "of"}
+
+logs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+report_fields = ['type', 'path', 'title', 'season']
+
+
+def normalize_title(title):
+    """
+    Normalizes a title so that media and asset titles can be compared with a dict lookup.
+
+    Parameters:
+        title (str): The title to normalize.
+
+    Returns:
+        str: The normalized title.
+    """
+    return normalize_regex.sub('', unidecode(title).replace('&', 'and')).strip().lower()
+
 
 def get_assets_files(assets_path):
     asset_folders = config.asset_folders
     series = {'series': []}
+    series_index = {}
     movies = {'movies': []}
     collections = {'collections': []}
 
     print("Getting assets files..., this may take a while.")
-    files = os.listdir(assets_path)
-    files = sorted(files, key=lambda x: x.lower())
+    folders, files = list_folder(assets_path)
+    files = sorted(folders + files, key=lambda x: x.lower())
 
     season_number = None
 
@@ -76,16 +112,16 @@ def get_assets_files(assets_path):
         return season_number
 
     def add_series(title_without_season_info, season_number):
-        if any(d['title'] == title_without_season_info for d in series['series']):
-            if season_number:
-                series['series'][-1]['season_number'].append(season_number)
-        else:
-            series['series'].append({
+        entry = series_index.get(title_without_season_info)
+        if entry is None:
+            entry = {
                 'title': title_without_season_info,
                 'season_number': []
-            })
-            if season_number:
-                series['series'][-1]['season_number'].append(season_number)
+            }
+            series_index[title_without_season_info] = entry
+            series['series'].append(entry)
+        if season_number:
+            entry['season_number'].append(season_number)
 
     if not asset_folders:
         for file in tqdm(files, desc=f'Sorting assets', total=len(files)):
@@ -97,20 +133,13 @@ def get_assets_files(assets_path):
                     'title': base_name
                 })
             else:
-                file_name = os.path.splitext(file)[0]
                 title = base_name
                 title = unidecode(title)
                 title_without_season_info = title
                 for season_info in season_name_info:
                     title_without_season_info = re.sub(
                         season_info + r'\d+', '', title_without_season_info)
-                if any(file.startswith(file_name) and any(file_name + season_name in file for season_name in season_name_info) for file in files):
-                    season_number = extract_season_info(base_name)
-                    if season_number:
-                        add_series(title_without_season_info, season_number)
-                    else:
-                        add_movies(title)
-                elif any(season_info in file for season_info in season_name_info):
+                if any(season_info in file for season_info in season_name_info):
                     season_number = extract_season_info(base_name)
                     if season_number:
                         add_series(title_without_season_info, season_number)
@@ -119,7 +148,7 @@ def get_assets_files(assets_path):
                 else:
                     movies['movies'].append({'title': title})
     else:
-        for root, dirs, files in os.walk(assets_path):
+        for root, dirs, files in walk_folder(assets_path):
             title = os.path.basename(root)
             if root == assets_path:
                 continue
@@ -133,10 +162,7 @@ def get_assets_files(assets_path):
                 })
             else:
                 if any(season_info in file for season_info in season_name_info for file in files):
-                    series['series'].append({
-                        'title': title,
-                        'season_number': []
-                    })
+                    add_series(title, None)
                     for file in files:
                         if file.startswith('.'):
                             continue
@@ -158,9 +184,96 @@ def get_assets_files(assets_path):
     return series, collections, movies
 
 
+def list_folder(path):
+    """
+    Lists a folder, reusing the cached listing if the folder has not changed since the last run.
+
+    Parameters:
+        path (str): The path to list.
+
+    Returns:
+        list: A sorted list of folder names and a sorted list of file names.
+    """
+    try:
+        return dir_cache.get_or_scan(path, list_dir)
+    except OSError as e:
+        logger.warning(f"Unable to read '{path}': {e}")
+        return [[], []]
+
+
+def walk_folder(path):
+    """
+    Walks a folder top down like os.walk, using list_folder for each folder.
+
+    Parameters:
+        path (str): The path to walk.
+
+    Yields:
+        tuple: The folder path, a list of folder names and a list of file names.
+    """
+    folders, files = list_folder(path)
+    yield path, folders, files
+    for folder in folders:
+        yield from walk_folder(os.path.join(path, folder))
+
+
+def list_subfolders(path):
+    """
+    Lists the folders directly inside a path.
+
+    Parameters:
+        path (str): The path to list.
+
+    Returns:
+        list: A sorted list of folder names.
+    """
+    return list_folder(path)[0]
+
+
+def classify_title_folder(path):
+    """
+    Lists a title folder once and classifies it from the cached DirEntry types.
+
+    Parameters:
+        path (str): The path of the title folder.
+
+    Returns:
+        list: A sorted list of season folders and whether the folder contains any folders, if not it is a movie.
+    """
+    season_folders = []
+    has_subfolders = False
+    for name in list_dir(path)[0]:
+        has_subfolders = True
+        if not (name.startswith("Season ") or name == "Specials"):
+            logger.debug(
+                f"Skipping '{name}' because it is not a season folder.")
+            continue
+        season_folders.append(name)
+    return [season_folders, has_subfolders]
+
+
+def scan_title_folder(path):
+    """
+    Classifies a title folder, reusing the cached result if the folder has not changed since the last run.
+
+    Parameters:
+        path (str): The path of the title folder.
+
+    Returns:
+        season_folders (list): A sorted list of season folders.
+        has_subfolders (bool): Whether the folder contains any folders, if not it is a movie.
+    """
+    try:
+        return title_cache.get_or_scan(path, classify_title_folder)
+    except OSError as e:
+        logger.warning(f"Unable to read '{path}': {e}")
+        return [], False
+
+
 def get_media_folders(media_paths):
     """
     Gets the folders from the media folders and sorts them into series and movies.
+    Media paths and title folders are scanned concurrently, the results are kept in path order.
 
     Parameters:
         media_paths (list): A list of paths to the media folders.
@@ -173,34 +286,24 @@ def get_media_folders(media_paths):
     movies = {'movies': []}
     print("Getting media folder information..., this may take a while.")
 
-    for media_path in media_paths:
-        base_name = os.path.basename(os.path.normpath(media_path))
-        for subfolder in sorted(Path(media_path).iterdir()):
-            if subfolder.is_dir():
-                for sub_sub_folder in sorted(Path(subfolder).iterdir()):
-                    if sub_sub_folder.is_dir():
-                        sub_sub_folder_base_name = os.path.basename(
-                            os.path.normpath(sub_sub_folder))
-                        if not (sub_sub_folder_base_name.startswith("Season ") or sub_sub_folder_base_name == "Specials"):
-                            logger.debug(
-                                f"Skipping '{sub_sub_folder_base_name}' because it is not a season folder.")
-                            continue
-                        if any(subfolder.name in s['title'] for s in series['series']):
-                            series['series'][-1]['season_number'].append(
-                                sub_sub_folder.name)
-                        else:
-                            series['series'].append({
-                                'title': subfolder.name,
-                                'season_number': [],
-                                'path': base_name
-                            })
-                            series['series'][-1]['season_number'].append(
-                                sub_sub_folder.name)
-                if not any(sub_sub_folder.is_dir() for sub_sub_folder in Path(subfolder).iterdir()):
-                    movies['movies'].append({
-                        'title': subfolder.name,
-                        'path': base_name
-                    })
+    with ThreadPoolExecutor(max_workers=config.workers) as executor:
+        title_folders = []
+        for media_path, subfolders in zip(media_paths, executor.map(list_subfolders, media_paths)):
+            base_name = os.path.basename(os.path.normpath(media_path))
+            title_folders.extend((base_name, subfolder, os.path.join(media_path, subfolder)) for subfolder in subfolders)
+        results = executor.map(scan_title_folder, [path for _, _, path in title_folders])
+        for (base_name, subfolder, _), (season_folders, has_subfolders) in tqdm(zip(title_folders, results), desc='Scanning media folders', total=len(title_folders)):
+            if season_folders:
+                series['series'].append({
+                    'title': subfolder,
+                    'season_number': season_folders,
+                    'path': base_name
+                })
+            if not has_subfolders:
+                movies['movies'].append({
+                    'title': subfolder,
+                    'path': base_name
+                })
     series = dict(sorted(series.items()))
     movies = dict(sorted(movies.items()))
     logger.debug("Media Directories:")
@@ -209,29 +312,116 @@ def get_media_folders(media_paths):
     return movies, series
 
 
+def get_media_from_arr():
+    """
+    Gets the movies, series and seasons from the Radarr and Sonarr instances instead of walking the media folders.
+    Movies are included once they have a file and seasons once they have at least one episode file,
+    which is when their folders exist on disk.
+
+    Returns:
+        media_movies (list): A list of movies.
+        media_series (list): A list of series.
+        covered (set): The names of the root folders of the media found.
+        failed (list): The names of the instances that couldn't be reached.
+    """
+    series = {'series': []}
+    movies = {'movies': []}
+    covered = set()
+    failed = []
+    print("Getting media information from Radarr/Sonarr...")
+    instance_data = {
+        'Radarr': (config.radarr_data, config.radarr),
+        'Sonarr': (config.sonarr_data, config.sonarr)
+    }
+    for instance_type, (instances, script_instances) in instance_data.items():
+        names = [data['name'] for data in script_instances or []]
+        for instance in instances:
+            if instance['name'] not in names:
+                continue
+            try:
+                app = StARR(instance['url'], instance['api'], logger)
+                media = app.get_media()
+            except (SystemExit, requests.exceptions.RequestException):
+                # StARR exits when an instance can't be reached, fall back to the media paths for this one only
+                logger.error(f"Unable to get media from {instance['name']}")
+                failed.append(instance['name'])
+                continue
+            if not media:
+                logger.warning(f"No media found in {instance['name']}")
+                continue
+            logger.debug(f"Found {len(media)} items in {instance['name']}")
+            for item in media:
+                title = os.path.basename(os.path.normpath(item['path']))
+                root_folder = item.get('rootFolderPath') or os.path.dirname(os.path.normpath(item['path']))
+                base_name = os.path.basename(os.path.normpath(root_folder))
+                covered.add(base_name)
+                if instance_type == 'Radarr':
+                    if item.get('hasFile'):
+                        movies['movies'].append({
+                            'title': title,
+                            'path': base_name
+                        })
+                else:
+                    season_folders = sorted(
+                        "Specials" if season['seasonNumber'] == 0 else f"Season {season['seasonNumber']:02d}"
+                        for season in item.get('seasons', [])
+                        if season.get('statistics', {}).get('episodeFileCount', 0) > 0
+                    )
+                    if season_folders:
+                        series['series'].append({
+                            'title': title,
+                            'season_number': season_folders,
+                            'path': base_name
+                        })
+    movies['movies'] = sorted(movies['movies'], key=lambda x: (x['path'], x['title']))
+    series['series'] = sorted(series['series'], key=lambda x: (x['path'], x['title']))
+    logger.debug("Radarr/Sonarr Media:")
+    logger.debug(json.dumps(series, ensure_ascii=False, indent=4))
+    logger.debug(json.dumps(movies, ensure_ascii=False, indent=4))
+    return movies, series, covered, failed
+
+
 def match_assets(asset_series, asset_movies, media_movies, media_series, plex_collections, asset_collections):
+    """
+    Matches the media and collections against the assets.
+    The assets are normalized once into dict/set indexes so each lookup is a single hash probe.
+
+    Parameters:
+        asset_series (dict): The series assets.
+        asset_movies (dict): The movie assets.
+        media_movies (dict): The movies from the media folders.
+        media_series (dict): The series from the media folders.
+        plex_collections (dict): The collections from Plex.
+        asset_collections (dict): The collection assets.
+
+    Returns:
+        unmatched_movies (dict): The movies without an asset.
+        unmatched_series (dict): The series and seasons without an asset.
+        unmatched_collections (dict): The collections without an asset.
+    """
     unmatched_series = {'unmatched_series': []}
     unmatched_movies = {'unmatched_movies': []}
     unmatched_collections = {'unmatched_collections': []}
 
+    asset_series_index = {}
+    for asset in asset_series['series']:
+        asset_series_index.setdefault(normalize_title(asset['title']), set(asset['season_number']))
+    asset_movies_index = {normalize_title(asset['title']) for asset in asset_movies['movies']}
+    asset_collections_index = {unidecode(asset['title']) for asset in asset_collections['collections']}
+
     for series in tqdm(media_series['series'], desc='Matching series', total=len(media_series['series'])):
-        asset_found = False
-        media_title  = re.sub(r'[^A-Za-z0-9]+', '', unidecode(series['title']).replace('&', 'and')).strip().lower()
-        for asset in asset_series['series']:
-            asset_title = re.sub(r'[^A-Za-z0-9]+', '', unidecode(asset['title']).replace('&', 'and')).strip().lower()
-            if asset_title == media_title:
-                asset_found = True
-                missing_seasons = [
-                    season for season in series['season_number'] if season not in asset['season_number']]
-                if missing_seasons:
-                    unmatched_series['unmatched_series'].append({
-                        'title': series['title'],
-                        'season_number': missing_seasons,
-                        'missing_season': True,
-                        'path': series['path']
-                    })
-                break
-        if not asset_found:
+        asset_seasons = asset_series_index.get(normalize_title(series['title']))
+        if asset_seasons is not None:
+            missing_seasons = [
+                season for season in series['season_number'] if season not in asset_seasons]
+            if missing_seasons:
+                unmatched_series['unmatched_series'].append({
+                    'title': series['title'],
+                    'season_number': missing_seasons,
+                    'missing_season': True,
+                    'path': series['path']
+                })
+        else:
             unmatched_series['unmatched_series'].append({
                 'title': series['title'],
                 'season_number': series['season_number'],
@@ -240,26 +430,14 @@ def match_assets(asset_series, asset_movies, media_movies, media_series, plex_co
             })
 
     for media_movie in tqdm(media_movies['movies'], desc='Matching movies', total=len(media_movies['movies'])):
-        asset_found = False
-        media_title = re.sub(r'[^A-Za-z0-9]+', '', unidecode(media_movie['title']).replace('&', 'and')).strip().lower()
-        for asset in asset_movies['movies']:
-            asset_title = re.sub(r'[^A-Za-z0-9]+', '', unidecode(asset['title']).replace('&', 'and')).strip().lower()
-            if media_title == asset_title:
-                asset_found = True
-                break
-        if not asset_found:
+        if normalize_title(media_movie['title']) not in asset_movies_index:
             unmatched_movies['unmatched_movies'].append({
                 'title': media_movie['title'],
                 'path': media_movie['path']
             })
 
     for plex_collection in tqdm(plex_collections['collections'], desc='Matching collections', total=len(plex_collections['collections'])):
-        asset_found = False
-        for asset in asset_collections['collections']:
-            if unidecode(plex_collection['title']) == unidecode(asset['title']):
-                asset_found = True
-                break
-        if not asset_found:
+        if unidecode(plex_collection['title']) not in asset_collections_index:
             unmatched_collections['unmatched_collections'].append({
                 'title': plex_collection['title'],
             })
@@ -271,6 +449,210 @@ def match_assets(asset_series, asset_movies, media_movies, media_series, plex_co
     return unmatched_movies, unmatched_series, unmatched_collections
 
 
+def report_rows(unmatched_movies, unmatched_series, unmatched_collections):
+    """
+    Flattens the unmatched items into report rows, one row per missing poster.
+
+    Parameters:
+        unmatched_movies (dict): The movies without an asset.
+        unmatched_series (dict): The series and seasons without an asset.
+        unmatched_collections (dict): The collections without an asset.
+
+    Yields:
+        dict: A report row.
+    """
+    for movie in unmatched_movies['unmatched_movies']:
+        yield {'type': 'movie', 'path': movie['path'], 'title': movie['title'], 'season': '', 'suggestions': movie.get('suggestions', [])}
+    for series in unmatched_series['unmatched_series']:
+        if not series['missing_season']:
+            yield {'type': 'series', 'path': series['path'], 'title': series['title'], 'season': '', 'suggestions': series.get('suggestions', [])}
+        for season in series['season_number']:
+            yield {'type': 'season', 'path': series['path'], 'title': series['title'], 'season': season, 'suggestions': []}
+    for collection in unmatched_collections['unmatched_collections']:
+        yield {'type': 'collection', 'path': '', 'title': collection['title'], 'season': '', 'suggestions': collection.get('suggestions', [])}
+
+
+def write_report(unmatched_movies, unmatched_series, unmatched_collections, diff):
+    """
+    Streams the unmatched items to the report in the logs folder and compares them against the previous run.
+
+    Parameters:
+        unmatched_movies (dict): The movies without an asset.
+        unmatched_series (dict): The series and seasons without an asset.
+        unmatched_collections (dict): The collections without an asset.
+        diff (bool): Whether or not to output the changes since the previous run.
+
+    Returns:
+        None
+    """
+    previous_keys = load_state("unmatched-assets_state")
+    current_keys = set()
+    newly_unmatched = []
+    writer = None
+    if config.report_format:
+        try:
+            writer = ReportWriter(f'{logs_dir}/unmatched-assets', config.report_format, report_fields + ['suggestions'])
+        except ValueError as e:
+            logger.error(e)
+    for row in report_rows(unmatched_movies, unmatched_series, unmatched_collections):
+        if writer:
+            writer.write(row)
+        key = tuple(row[field] for field in report_fields)
+        current_keys.add(key)
+        if diff and previous_keys is not None and key not in previous_keys:
+            newly_unmatched.append(row)
+    if writer:
+        writer.close()
+        logger.info(f"Wrote {writer.count} unmatched items to {writer.path}")
+    save_state("unmatched-assets_state", current_keys)
+    if not diff:
+        return
+    if previous_keys is None:
+        logger.info("No previous run found to compare against, run the script again to see what has changed.")
+        return
+    newly_matched = [dict(zip(report_fields, key)) for key in sorted(previous_keys - current_keys)]
+    diff_writer = ReportWriter(f'{logs_dir}/unmatched-assets_diff', writer.report_format if writer else 'jsonl', report_fields + ['suggestions', 'change'])
+    for change, rows in (("unmatched", newly_unmatched), ("matched", newly_matched)):
+        if rows:
+            logger.info(f"Newly {change}:")
+        for row in rows:
+            row['change'] = change
+            diff_writer.write(row)
+            season = f" {row['season']}" if row['season'] else ''
+            path = f" ({row['path']})" if row['path'] else ''
+            logger.info(f"\t{row['type'].capitalize()}: {row['title']}{season}{path}")
+    diff_writer.close()
+    logger.info(f"{len(newly_unmatched)} newly unmatched, {len(newly_matched)} newly matched since the previous run. Changes written to {diff_writer.path}")
+
+
+class FuzzyIndex:
+    def __init__(self, titles):
+        """
+        Initialize a FuzzyIndex object, an index of asset titles used to suggest the closest assets for a title.
+        Titles are blocked by character trigrams so only titles sharing enough of them are scored.
+
+        Parameters:
+            titles (list): The asset titles.
+        """
+        self.titles = titles
+        self.choices = [self.normalize(title) for title in titles]
+        self.postings = {}
+        for i, choice in enumerate(self.choices):
+            for gram in self.grams(choice):
+                self.postings.setdefault(gram, []).append(i)
+
+    @staticmethod
+    def normalize(title):
+        """
+        Lowercases and transliterates a title, keeping the year as a plain number at the end so it can be compared on its own.
+        """
+        title = suggestion_year_regex.sub(r" \1", unidecode(title).replace('&', 'and').lower())
+        return ' '.join(token_regex.findall(title))
+
+    @staticmethod
+    def split_year(normalized_title):
+        """
+        Splits the year off the end of a normalized title, the year is None if the title doesn't have one.
+        """
+        words = normalized_title.split()
+        if len(words) > 1 and len(words[-1]) == 4 and words[-1].isdigit():
+            return ' '.join(words[:-1]), int(words[-1])
+        return normalized_title, None
+
+    @staticmethod
+    def grams(normalized_title):
+        """
+        Gets the character trigrams of a normalized title used for blocking, the year, common words and spacing are left out
+        so "Spiderman" and "The Spider-Man" share all of theirs.
+        """
+        words = FuzzyIndex.split_year(normalized_title)[0].split()
+        text = ''.join(word for word in words if word not in stop_words) or ''.join(words)
+        if len(text) < 3:
+            return {text}
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    @staticmethod
+    def score(query, choice, **kwargs):
+        """
+        Scores two normalized titles, ignoring word order ("Matrix, The") and spacing ("Spiderman").
+        Years are compared as numbers, a year off by one costs nothing and every further year costs 10 points.
+        """
+        query_title, query_year = FuzzyIndex.split_year(query)
+        choice_title, choice_year = FuzzyIndex.split_year(choice)
+        score = max(fuzz.token_sort_ratio(query_title, choice_title), fuzz.ratio(query_title.replace(' ', ''), choice_title.replace(' ', '')))
+        if query_year and choice_year:
+            score -= 10 * max(0, abs(query_year - choice_year) - 1)
+        return max(0, score)
+
+    def suggest(self, title, limit, score_cutoff):
+        """
+        Gets the closest asset titles for a title.
+
+        Parameters:
+            title (str): The title to find suggestions for.
+            limit (int): The maximum number of suggestions.
+            score_cutoff (int): The minimum score (0-100) of a suggestion.
+
+        Returns:
+            list: The suggestions as dicts with a title and a score.
+        """
+        query = self.normalize(title)
+        grams = self.grams(query)
+        shared = {}
+        for gram in grams:
+            for i in self.postings.get(gram, []):
+                shared[i] = shared.get(i, 0) + 1
+        minimum = max(1, len(grams) // 2)
+        choices = {i: self.choices[i] for i, count in shared.items() if count >= minimum}
+        if not choices:
+            return []
+        matches = process.extract(query, choices, scorer=self.score, limit=limit, score_cutoff=score_cutoff)
+        return [{'title': self.titles[i], 'score': round(score, 1)} for _, score, i in matches]
+
+
+def add_suggestions(unmatched_movies, unmatched_series, unmatched_collections, asset_movies, asset_series, asset_collections):
+    """
+    Adds the closest assets to each unmatched movie, series and collection, these are often the same
+    poster saved under a slightly different title.
+
+    Parameters:
+        unmatched_movies (dict): The movies without an asset.
+        unmatched_series (dict): The series and seasons without an asset.
+        unmatched_collections (dict): The collections without an asset.
+        asset_movies (dict): The movie assets.
+        asset_series (dict): The series assets.
+        asset_collections (dict): The collection assets.
+
+    Returns:
+        None
+    """
+    if not config.suggestions:
+        return
+    if process is None:
+        logger.warning("rapidfuzz is not installed, skipping suggestions. Please install it with 'pip install rapidfuzz'")
+        return
+    groups = [
+        (unmatched_movies['unmatched_movies'], asset_movies['movies']),
+        ([series for series in unmatched_series['unmatched_series'] if not series['missing_season']], asset_series['series']),
+        (unmatched_collections['unmatched_collections'], asset_collections['collections']),
+    ]
+    for unmatched, assets in groups:
+        if not unmatched or not assets:
+            continue
+        index = FuzzyIndex([asset['title'] for asset in assets])
+        for item in tqdm(unmatched, desc='Finding suggestions', total=len(unmatched)):
+            suggestions = index.suggest(item['title'], config.suggestions, config.suggestion_threshold)
+            if suggestions:
+                item['suggestions'] = suggestions
+
+
+def format_suggestions(item):
+    """
+    Formats the suggestions of an unmatched item for the log.
+    """
+    return ', '.join(f"{suggestion['title']} ({suggestion['score']:g})" for suggestion in item['suggestions'])
+
+
 def print_output(unmatched_movies, unmatched_series, unmatched_collections, media_movies, media_series, plex_collections):
     """
     Prints the output of the unmatched function.
@@ -304,6 +686,8 @@ def print_output(unmatched_movies, unmatched_series, unmatched_collections, medi
                 logger.info(f"\t{movie['path'].capitalize()}")
                 previous_path = movie['path']
             logger.info(f"\t\t{movie['title']}")
+            if movie.get('suggestions'):
+                logger.info(f"\t\t\tDid you mean: {format_suggestions(movie)}")
             unmatched_movies_total += 1
         logger.info(f"\t{unmatched_movies_total} unmatched movies found: Percent complete: ({100 - 100 * unmatched_movies_total / total_movies:.2f}% of total {total_movies}).")
     unmatched_series = sorted(
@@ -323,6 +707,8 @@ def print_output(unmatched_movies, unmatched_series, unmatched_collections, medi
             else:
                 output = f"Series poster unavailable"
                 logger.info(f"\t\t{series['title']}, {output}")
+                if series.get('suggestions'):
+                    logger.info(f"\t\t\tDid you mean: {format_suggestions(series)}")
                 for season in series['season_number']:
                     logger.info(f"\t\t\t{season}")
             unmatched_series_total += 1
@@ -336,6 +722,8 @@ def print_output(unmatched_movies, unmatched_series, unmatched_collections, medi
         logger.info("Unmatched Collections:")
         for collection in unmatched_collections['unmatched_collections']:
             logger.info(f"\t{collection['title']}")
+            if collection.get('suggestions'):
+                logger.info(f"\t\tDid you mean: {format_suggestions(collection)}")
             unmatched_collections_total += 1
         logger.info(f"\t{unmatched_collections_total} unmatched collections found: Percent complete: ({100 - 100 * unmatched_collections_total / unmatched_collections_total:.2f}% of total {total_collections}).\n")
     logger.info(f"Grand total: {unmatched_movies_total} unmatched movies, {unmatched_series_total} unmatched series, {unmatched_seasons} unmatched seasons, {unmatched_collections_total} unmatched collections. Grand percent complete: ({100 - 100 * (unmatched_movies_total + unmatched_series_total + unmatched_seasons + unmatched_collections_total) / (total_movies + total_series + total_seasons + total_collections):.2f}% of grand total {total_movies + total_series + total_seasons + total_collections}).\n")
@@ -345,6 +733,9 @@ def main():
     """
     Main function for the script.
     """
+    parser = argparse.ArgumentParser(description="Check your media and collections for assets that are missing.")
+    parser.add_argument('--diff', action='store_true', help="Only output what has been newly matched or unmatched since the previous run.")
+    args = parser.parse_args()
     url = None
     api_key = None
     app = None
@@ -356,8 +747,12 @@ def main():
     logger.debug(f"{'Asset Folders: ':<20}{config.asset_folders}")
     logger.debug(f'{"Assets path:":<20}{config.assets_path if config.assets_path else "Not set"}')
     logger.debug(f'{"Media paths:":<20}{config.media_paths if config.media_paths else "Not set"}')
+    logger.debug(f'{"Inventory:":<20}{config.inventory}')
+    logger.debug(f'{"Suggestions:":<20}{config.suggestions} (threshold: {config.suggestion_threshold})')
     logger.debug(f'{"Library names:":<20}{config.library_names if config.library_names else "Not set"}')
     logger.debug(f'{"Ignore collections:":<20}{config.ignore_collections if config.ignore_collections else "Not set"}')
+    logger.debug(f'{"Use cache:":<20}{config.use_cache}')
+    logger.debug(f'{"Report format:":<20}{config.report_format if config.report_format else "Not set"}')
     logger.debug('*' * 40)
     logger.debug('')
     if config.plex_data:
@@ -370,7 +765,24 @@ def main():
         logger.info("No library names specified in config.yml. Skipping Plex.")
     asset_series, asset_collections, asset_movies = get_assets_files(
         config.assets_path)
-    media_movies, media_series = get_media_folders(config.media_paths)
+    media_movies = None
+    if config.inventory == 'arr':
+        media_movies, media_series, covered, failed = get_media_from_arr()
+        if not (media_movies['movies'] or media_series['series']):
+            logger.warning("No media found in Radarr/Sonarr, falling back to the media paths.")
+            media_movies = None
+        elif failed:
+            # Scan the media paths that none of the instances that answered have media in
+            fallback_paths = [path for path in config.media_paths if os.path.basename(os.path.normpath(path)) not in covered]
+            logger.warning(f"Unable to get media from {', '.join(failed)}, falling back to {len(fallback_paths)} media paths.")
+            if fallback_paths:
+                folder_movies, folder_series = get_media_folders(fallback_paths)
+                media_movies['movies'] = sorted(media_movies['movies'] + folder_movies['movies'], key=lambda x: (x['path'], x['title']))
+                media_series['series'] = sorted(media_series['series'] + folder_series['series'], key=lambda x: (x['path'], x['title']))
+    elif config.inventory != 'filesystem':
+        logger.error(f"Unknown inventory: {config.inventory}, options are 'filesystem' or 'arr'. Falling back to the media paths.")
+    if media_movies is None:
+        media_movies, media_series = get_media_folders(config.media_paths)
     collections = []
     if config.library_names and app:
         for library_name in config.library_names:
@@ -396,7 +808,12 @@ def main():
         sanitized_collection = illegal_chars_regex.sub('', collection)
         dict_plex['collections'].append({'title': sanitized_collection})
     unmatched_movies, unmatched_series, unmatched_collections = match_assets(asset_series, asset_movies, media_movies, media_series, dict_plex, asset_collections)
-    print_output(unmatched_movies, unmatched_series, unmatched_collections, media_movies, media_series, dict_plex)
+    add_suggestions(unmatched_movies, unmatched_series, unmatched_collections, asset_movies, asset_series, asset_collections)
+    if not args.diff:
+        print_output(unmatched_movies, unmatched_series, unmatched_collections, media_movies, media_series, dict_plex)
+    write_report(unmatched_movies, unmatched_series, unmatched_collections, args.diff)
+    dir_cache.save()
+    title_cache.save()
 
 
 if __name__ == "__main__":
@@ -9,15 +9,27 @@
 # ===================================================================================================
 # Author: Drazzilb
 # Description: A script to upgrade Sonarr/Radarr libraries to the keep in line with trash-guides
+#              Optionally keeps a schedule of when each item was last searched to pick what to search next
+#              and sizes each batch to keep the download queue at a target depth.  Instances are processed
+#              at the same time with their output kept together.
 # Usage: python3 /path/to/upgradinatorr.py
-# Requirements: requests, pyyaml
-# Version: 2.1.6
+# Requirements: requests, pyyaml, qbittorrentapi
+# Version: 2.5.0
 # License: MIT License
 # ===================================================================================================
 
+import time
+import threading
+import requests
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from qbittorrentapi import Client
+from qbittorrentapi.exceptions import APIError
 from modules.config import Config
-from modules.logger import setup_logger
+from modules.logger import setup_logger, buffer_logs
 from modules.arrpy import StARR
+from modules.searchqueue import TokenBucket
+from modules.upgradeschedule import UpgradeSchedule
 
 config = Config(script_name="upgradinatorr")
 logger = setup_logger(config.log_level, "upgradinatorr")
@@ -49,18 +61,261 @@ def check_all_tagged(all_media, tag_id, status, monitored):
             return False
     return True
 
-def process_instance(instance_type, instance_name, count, tag_name, unattended, status, monitored, url, api, dry_run, reset):
+def get_cutoff_unmet(app, instance_type):
+    """
+    Get the media that is below its cutoff from the wanted/cutoff endpoint instead of the whole library.
+    Sonarr reports episodes, they are grouped into their series as searches are done per series.
+    Parameters:
+        app (StARR): The ARR instance.
+        instance_type (str): 'Radarr' or 'Sonarr'.
+    Returns:
+        list: The movies or series below the cutoff.
+    """
+    if instance_type == "Radarr":
+        return list(app.iter_wanted_cutoff(workers=config.workers))
+    series = {}
+    for episode in app.iter_wanted_cutoff(workers=config.workers):
+        if episode.get('series'):
+            series.setdefault(episode['seriesId'], episode['series'])
+    return list(series.values())
+
+def filter_media(media, status, monitored):
+    """
+    Get the media in the given status and monitored state.
+    Parameters:
+        media (list): The movies or series.
+        status (str or list): The status to check for, or 'all'.
+        monitored (bool): Whether or not to check for monitored media.
+    Returns:
+        list: The matching media.
+    """
+    if isinstance(status, str):
+        return [m for m in media if m['monitored'] == monitored and (status == "all" or status == m['status'])]
+    return [m for m in media if m['monitored'] == monitored and m['status'] in status]
+
+def get_signatures(app, media, instance_type):
+    """
+    Get a signature of the files of each item, the IDs of its files. An upgrade replaces a file with one that has a new ID.
+    Sonarr series are signed by the IDs of their episode files, so episodes that air later don't change the files that were searched.
+    Parameters:
+        app (StARR): The ARR instance.
+        media (list): The movies or series.
+        instance_type (str): 'Radarr' or 'Sonarr'.
+    Returns:
+        dict: media id -> the signature, or None if the item has no files.
+    """
+    if instance_type == "Radarr":
+        return {item['id']: str(item['movieFile']['id']) if item.get('movieFile') else None for item in media}
+    signatures = {item['id']: None for item in media}
+    # The series of wanted/cutoff episodes come without statistics, those are always fetched and stay None if they have no files
+    series_ids = [item['id'] for item in media if 'statistics' not in item or item['statistics'].get('episodeFileCount')]
+    for series_id, episode_files in app.iter_episode_files(series_ids, config.workers):
+        if episode_files:
+            signatures[series_id] = ",".join(sorted(str(episode_file['id']) for episode_file in episode_files))
+    return signatures
+
+def pick_scheduled(media, history, priority, search_interval):
+    """
+    Order the media that is due for a search by priority.
+    Parameters:
+        media (list): The movies or series to pick from.
+        history (dict): The search history of the instance.
+        priority (str): 'oldest_search', 'lowest_score' or 'recently_added'.
+        search_interval (float): The number of days before an item can be searched again.
+    Returns:
+        list: The media that is due, in the order it should be searched.
+    """
+    now = time.time()
+    due = [item for item in media if item['id'] not in history or now - history[item['id']]['last_searched'] >= search_interval * 86400]
+    def last_searched(item):
+        return history[item['id']]['last_searched'] if item['id'] in history else 0
+    if priority == 'recently_added':
+        # ISO 8601 timestamps sort in time order as strings
+        return sorted(due, key=lambda item: item.get('added', ''), reverse=True)
+    if priority == 'lowest_score':
+        # Only Radarr reports a custom format score, anything without one goes last
+        def key(item):
+            score = (item.get('movieFile') or {}).get('customFormatScore')
+            return (score is None, score or 0, last_searched(item))
+        return sorted(due, key=key)
+    return sorted(due, key=last_searched)
+
+def get_client_status():
+    """
+    Get the number of torrents downloading in the qBittorrent instances and check their free space.
+    The status is shared by the instances processed at the same time, the searches each one makes are reserved under the lock.
+    Returns:
+        dict: downloading -> the number of active downloads, low_space -> the names of the instances below min_free_space,
+              reserved -> instance name -> the searches it has made or is about to make, lock -> the lock guarding reserved
+    """
+    client_status = {'downloading': 0, 'low_space': [], 'reserved': {}, 'lock': threading.Lock()}
+    for item in config.qbit or []:
+        qbit_data = next((data for data in config.qbit_data if data['name'] == item['name']), None)
+        if qbit_data is None:
+            logger.error(f"qBittorrent instance {item['name']} not found in the global config")
+            continue
+        url_parts = urlsplit(qbit_data['url'])
+        try:
+            qb = Client(host=url_parts.hostname, port=url_parts.port)
+            qb.auth_log_in(username=qbit_data['username'], password=qbit_data['password'])
+            downloading = len(qb.torrents_info(status_filter='downloading'))
+            free_space = qb.sync_maindata()['server_state']['free_space_on_disk']
+        except APIError as e:
+            logger.error(f"Unable to get the status of {item['name']}: {e}")
+            continue
+        client_status['downloading'] += downloading
+        min_free_space = item.get('min_free_space')
+        if min_free_space and free_space < min_free_space * 1024 ** 3:
+            client_status['low_space'].append(item['name'])
+        logger.debug(f"{item['name']}: {downloading} downloading, {free_space / 1024 ** 3:.2f} GB free")
+    return client_status
+
+def size_batch(app, instance_name, count, target_queue, client_status):
+    """
+    Size the batch so the number of downloads in flight stays at the target depth.
+    Searching more while the queue is full only makes it longer and slows down imports.
+    Parameters:
+        app (StARR): The ARR instance.
+        instance_name (str): The name of the instance.
+        count (int): The most items to search.
+        target_queue (int): The number of downloads to aim for.
+        client_status (dict): The status of the qBittorrent instances from get_client_status().
+    Returns:
+        int: The number of items to search.
+    """
+    if client_status['low_space']:
+        logger.info(f"Skipping searches for {instance_name}, {', '.join(client_status['low_space'])} is low on free space")
+        return 0
+    queue_status = app.get_queue_status() or {}
+    queued = queue_status.get('totalCount', 0)
+    with client_status['lock']:
+        # qBittorrent can be shared by several instances, whichever queue is deeper decides. The searches of the other
+        # instances in this run aren't downloading yet, they come out of the same target
+        reserved = sum(searches for name, searches in client_status['reserved'].items() if name != instance_name)
+        depth = max(queued, client_status['downloading']) + reserved
+        batch = max(0, min(count, target_queue - depth))
+        client_status['reserved'][instance_name] = batch
+    logger.info(f"Queue: {queued} in {instance_name}, {client_status['downloading']} downloading in qBittorrent, {reserved} searched by other instances, target {target_queue}, searching {batch} of {count}")
+    return batch
+
+def release_batch(client_status, instance_name, searched):
+    """
+    Give back the part of a reserved batch that wasn't searched, so the instances sized after it can use it.
+    Parameters:
+        client_status (dict): The status of the qBittorrent instances from get_client_status().
+        instance_name (str): The name of the instance.
+        searched (int): The number of items searched, None if the instance failed.
+    """
+    with client_status['lock']:
+        if instance_name in client_status['reserved']:
+            client_status['reserved'][instance_name] = min(client_status['reserved'][instance_name], searched or 0)
+
+def report_throughput(app, instance_type, instance_name, upgrade_schedule):
+    """
+    Log how many of the items searched in the last run have been grabbed and imported since.
+    Parameters:
+        app (StARR): The ARR instance.
+        instance_type (str): 'Radarr' or 'Sonarr'.
+        instance_name (str): The name of the instance.
+        upgrade_schedule (UpgradeSchedule): The schedule the runs are recorded in.
+    """
+    run = upgrade_schedule.last_run(instance_name)
+    if run is None:
+        return
+    started, media_ids = run
+    date = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(started))
+    id_key = 'movieId' if instance_type == "Radarr" else 'seriesId'
+    searched = set(media_ids)
+    grabbed = {record.get(id_key) for record in app.get_history_since(date, 'grabbed')} & searched
+    imported = {record.get(id_key) for record in app.get_history_since(date, 'downloadFolderImported')} & searched
+    logger.info(f"Throughput of the run on {time.strftime('%Y-%m-%d %H:%M', time.localtime(started))}: {len(searched)} searched -> {len(grabbed)} grabbed -> {len(imported)} imported")
+
+def schedule_searches(instance_type, instance_name, app, media, arr_tag_id, tag_name, count, batch, status, monitored, upgrade_schedule, schedule, cutoff_unmet, dry_run):
+    """
+    Search the items that are due according to the search history instead of the first untagged items.
+    Searched items are still tagged, but the tags are never reset as items become due again after search_interval days.
+    Parameters:
+        instance_type (str): 'Radarr' or 'Sonarr'.
+        instance_name (str): The name of the instance.
+        app (StARR): The ARR instance.
+        media (list): The movies or series.
+        arr_tag_id (int): The ID of the tag to add.
+        tag_name (str): The name of the tag to add.
+        count (int): The most items to search in one run.
+        batch (int): The most items to search in this run.
+        status (str or list): The status to check for.
+        monitored (bool): Whether or not to check for monitored media.
+        upgrade_schedule (UpgradeSchedule): The search history.
+        schedule (dict): The priority, searches_per_day and search_interval settings.
+        cutoff_unmet (bool): Whether media only holds the items below their cutoff.
+        dry_run (bool): Whether or not to only log the searches.
+    Returns:
+        list: The IDs of the items searched.
+    """
+    if not dry_run:
+        history = upgrade_schedule.history(instance_name)
+        # Only the items waiting on the result of a search need their current files, the rest keep their signature
+        searched = [item for item in media if item['id'] in history and history[item['id']]['result'] == 'searched']
+        signatures = {media_id: entry['signature'] for media_id, entry in history.items()}
+        signatures.update(get_signatures(app, searched, instance_type))
+        signatures = {item['id']: signatures.get(item['id']) for item in media}
+        upgraded = upgrade_schedule.update_results(instance_name, signatures, complete=not cutoff_unmet)
+        if upgraded:
+            logger.info(f"{upgraded} items have been upgraded since they were searched")
+    history = upgrade_schedule.history(instance_name)
+    due = pick_scheduled(filter_media(media, status, monitored), history, schedule['priority'], schedule['search_interval'])
+    if schedule['searches_per_day']:
+        # Spread the searches over the day, count is the most that can be saved up for a single run
+        budget = TokenBucket(f"upgradinatorr_{instance_name}", count, schedule['searches_per_day'] / 24)
+        batch = min(batch, budget.available())
+        logger.info(f"The search budget allows {batch} of {count} searches this run")
+        if not dry_run and batch and due:
+            budget.take(min(batch, len(due)))
+    media_to_process = due[:batch]
+    media_ids_to_process = [item["id"] for item in media_to_process]
+    if not dry_run:
+        if media_ids_to_process:
+            app.add_tag(media_ids_to_process, arr_tag_id)
+            app.search_media(media_ids_to_process)
+            upgrade_schedule.record(instance_name, get_signatures(app, media_to_process, instance_type))
+        for title in media_to_process:
+            logger.info(f"Search request sent for '{title['title']}', this item has been tagged with '{tag_name}'")
+    else:
+        for title in media_to_process:
+            logger.info(f"Search request would have been sent for '{title['title']}', this item would have been tagged with '{tag_name}'")
+    results = [entry['result'] for entry in history.values()]
+    logger.info(f"Due for a search: {len(due)}, Searched this run: {len(media_to_process)}, Searched before: {len(history)}, Upgraded after a search: {results.count('upgraded')}\n")
+    return media_ids_to_process
+
+def process_instance(instance_type, instance_name, count, tag_name, unattended, status, monitored, url, api, dry_run, reset, cutoff_unmet=False, schedule=None, target_queue=None, client_status=None):
     media_type = None
     tagged_count = 0
     untagged_count = 0
     total_count = 0
+    started = time.time()
     app = StARR(url, api, logger)
-    media = app.get_media()
+    upgrade_schedule = UpgradeSchedule("upgradinatorr_schedule")
+    report_throughput(app, instance_type, instance_name, upgrade_schedule)
+    batch = count
+    if target_queue is not None:
+        batch = size_batch(app, instance_name, count, target_queue, client_status or get_client_status())
+    if cutoff_unmet:
+        media = get_cutoff_unmet(app, instance_type)
+        logger.info(f"{len(media)} items are below their cutoff in {instance_name}")
+        if not media:
+            return 0
+    else:
+        media = app.get_media()
     if instance_type == "Radarr":
         media_type = "Movies"
     elif instance_type == "Sonarr":
         media_type = "Series"
     arr_tag_id = app.check_and_create_tag(tag_name, dry_run)
+    if schedule and schedule['priority']:
+        media_ids = schedule_searches(instance_type, instance_name, app, media, arr_tag_id, tag_name, count, batch, status, monitored, upgrade_schedule, schedule, cutoff_unmet, dry_run)
+        if media_ids and not dry_run:
+            upgrade_schedule.add_run(instance_name, started, media_ids)
+        return len(media_ids)
     all_tagged = check_all_tagged(media, arr_tag_id, status, monitored)
     if reset:
         if not dry_run:
@@ -82,17 +337,16 @@ def process_instance(instance_type, instance_name, count, tag_name, unattended,
         logger.info(f'All of {instance_name} has been tagged with {tag_name}')
         logger.info("If you would like to remove the tag and re-run the script, please set reset to True or set unattended to True.")
         logger.info(f"Skipping {instance_name}...")
-        return
+        return 0
     if not all_tagged:
-        if isinstance(status, str):
-            untagged_media = [m for m in media if arr_tag_id not in m['tags'] and m['monitored'] == monitored and (status == "all" or status == m['status'])]
-        elif isinstance(status, list):
-            untagged_media = [m for m in media if arr_tag_id not in m['tags'] and m['monitored'] == monitored and any(stat == m['status'] for stat in status)]
-        media_to_process = untagged_media[:count]
+        untagged_media = [m for m in filter_media(media, status, monitored) if arr_tag_id not in m['tags']]
+        media_to_process = untagged_media[:batch]
         media_ids_to_process = [item["id"] for item in media_to_process]
         if not dry_run:
-            app.add_tag(media_ids_to_process, arr_tag_id)
-            app.search_media(media_ids_to_process)
+            if media_ids_to_process:
+                app.add_tag(media_ids_to_process, arr_tag_id)
+                app.search_media(media_ids_to_process)
+                upgrade_schedule.add_run(instance_name, started, media_ids_to_process)
             for title in media_to_process:
                 logger.info(f"Search request sent for '{title['title']}', this item has been tagged with '{tag_name}'")
         else:
@@ -107,6 +361,39 @@ def process_instance(instance_type, instance_name, count, tag_name, unattended,
         tagged_percent = (tagged_count / total_count) * 100
         untagged_percent = (untagged_count / total_count) * 100
         logger.info(f'Total {media_type}: {total_count}, Tagged {media_type}: {tagged_count} ({tagged_percent:.2f}%), Untagged {media_type}: {untagged_count} ({untagged_percent:.2f}%)\n')
+        return len(media_to_process)
+    return 0
+
+def run_instance(instance_name, url, api, args, client_status):
+    """
+    Process an instance with its output held back until it is done.
+    Parameters:
+        instance_name (str): The name of the instance.
+        url (str): The URL of the instance.
+        api (str): The API key of the instance.
+        args (tuple): The arguments for process_instance.
+        client_status (dict): The status of the qBittorrent instances, shared with the other instances.
+    Returns:
+        list: The name of the instance, the number of items searched (None if it failed) and the seconds it took.
+    """
+    started = time.time()
+    with buffer_logs(logger):
+        logger.info('*' * 40)
+        logger.info(f'* {instance_name:^36} *')
+        logger.info('*' * 40)
+        logger.debug(f'{" Settings ":*^40}')
+        logger.debug(f"Instance Name: {instance_name}")
+        logger.debug(f"URL: {url}")
+        logger.debug(f"api: {'*' * (len(api) - 5)}{api[-5:]}")
+        searched = None
+        try:
+            searched = process_instance(*args)
+        except (SystemExit, requests.exceptions.RequestException):
+            # StARR exits or the request raises when an instance can't be reached, the other instances carry on
+            logger.error(f"Processing {instance_name} failed")
+        finally:
+            release_batch(client_status, instance_name, searched)
+    return [instance_name, searched, time.time() - started]
 
 def main():
     """
@@ -118,6 +405,9 @@ def main():
     status = None
     monitored = None
     reset = False
+    cutoff_unmet = False
+    schedule = None
+    target_queue = None
     logger.debug('*' * 40)
     logger.debug(f'* {"Script Input Validated":^36} *')
     logger.debug('*' * 40)
@@ -133,10 +423,12 @@ def main():
         logger.info(f'* {" NO CHANGES WILL BE MADE ":^36} *')
         logger.info('*' * 40)
         logger.info('')
+    client_status = get_client_status()
     instance_data = {
         'Radarr': config.radarr_data,
         'Sonarr': config.sonarr_data
     }
+    tasks = []
 
     for instance_type, instances in instance_data.items():
         for instance in instances:
@@ -154,6 +446,13 @@ def main():
                     unattended = data.get('unattended', False)
                     monitored = data.get('monitored', True)
                     status = data.get('status', 'all')
+                    cutoff_unmet = data.get('cutoff_unmet', False)
+                    schedule = {
+                        'priority': data.get('priority', None),
+                        'searches_per_day': data.get('searches_per_day', None),
+                        'search_interval': data.get('search_interval', 7),
+                    }
+                    target_queue = data.get('target_queue', None)
             elif instance_type == "Sonarr" and config.sonarr:
                 data = next((data for data in config.sonarr if data['name'] == instance_name), None)
                 if data:
@@ -163,16 +462,29 @@ def main():
                     tag_name = data.get('tag_name', 'Upgradinatorr')
                     reset = data.get('reset', False)
                     unattended = data.get('unattended', False)
+                    monitored = data.get('monitored', True)
                     status = data.get('status', 'all')
+                    cutoff_unmet = data.get('cutoff_unmet', False)
+                    schedule = {
+                        'priority': data.get('priority', None),
+                        'searches_per_day': data.get('searches_per_day', None),
+                        'search_interval': data.get('search_interval', 7),
+                    }
+                    target_queue = data.get('target_queue', None)
             if script_name and instance_name == script_name:
-                logger.info('*' * 40)
-                logger.info(f'* {instance_name:^36} *')
-                logger.info('*' * 40)
-                logger.debug(f'{" Settings ":*^40}')
-                logger.debug(f"Instance Name: {instance_name}")
-                logger.debug(f"URL: {url}")
-                logger.debug(f"api: {'*' * (len(api) - 5)}{api[-5:]}")
-                process_instance(instance_type, instance_name, count, tag_name, unattended, status, monitored, url, api, config.dry_run, reset)
+                args = (instance_type, instance_name, count, tag_name, unattended, status, monitored, url, api, config.dry_run, reset, cutoff_unmet, schedule, target_queue, client_status)
+                tasks.append((instance_name, url, api, args, client_status))
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, config.instance_workers)) as executor:
+        results = list(executor.map(lambda task: run_instance(*task), tasks))
+    logger.info(f'{" Summary ":*^40}')
+    for instance_name, searched, seconds in results:
+        if searched is None:
+            logger.info(f"{instance_name}: failed after {seconds:.1f}s")
+        else:
+            logger.info(f"{instance_name}: {searched} {'would be searched' if config.dry_run else 'searched'} in {seconds:.1f}s")
+    total = sum(searched for _, searched, _ in results if searched)
+    logger.info(f"Total: {total} {'would be searched' if config.dry_run else 'searched'} across {len(results)} instances in {time.time() - started:.1f}s")
 
 if __name__ == '__main__':
     """